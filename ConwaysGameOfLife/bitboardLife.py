@@ -0,0 +1,215 @@
+#
+# Bitboard engine for very large Game of Life worlds
+#  Every row is packed into 64 bit words, bit i of word w being column
+#  64 * w + i (byte views assume a little endian host, as the Pi and PCs
+#  are), so an 8192x8192 world is 8 MB. A generation is bitwise adder
+#  logic over whole rows: the horizontal sums of the row above, the row
+#  itself (without the cell) and the row below, added as two bit numbers.
+#  Rows are processed in bands so the temporaries stay small.
+#  Cells past the edge count as dead, like in the other engines.
+#
+#  Cells keep no color or age: a live cell is drawn in a color that comes
+#  from its position, so still lifes and oscillators keep their colors.
+#
+#  The board hash is Zobrist hashing by word rather than by cell: the XOR of
+#  a 64 bit hash of every non empty word and its index, so a generation
+#  only rehashes the words it changed.
+#
+
+import random
+
+import numpy
+
+import lifeHash
+
+WORD_BITS = 64
+BAND_ROWS = 256
+SEED_PERCENT = 9        # World.seedRandom's randrange(100) > 90
+
+ONE = numpy.uint64(1)
+TOP_BIT = numpy.uint64(WORD_BITS - 1)
+
+# Popcount per byte, for NumPy without bitwise_count
+BYTE_BITS = numpy.array([bin(value).count("1") for value in range(256)], dtype=numpy.uint8)
+
+
+def wordCounts(words):
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(words).astype(numpy.int64)
+    return BYTE_BITS[words.view(numpy.uint8)].reshape(-1, 8).sum(axis=1, dtype=numpy.int64)
+
+
+def popcount(words) -> int:
+    if hasattr(numpy, "bitwise_count"):
+        return int(numpy.bitwise_count(words).sum(dtype=numpy.int64))
+    return int(BYTE_BITS[words.view(numpy.uint8)].sum(dtype=numpy.int64))
+
+
+# Hash of each word at the given flat indices, 0 for empty words
+def wordHashes(indices, words):
+    hashes = lifeHash.splitmix64(lifeHash.cellKeys(indices) ^ words)
+    hashes[words == 0] = 0
+    return hashes
+
+
+def xorWordHashes(indices, words) -> int:
+    if len(indices) == 0:
+        return 0
+    return int(numpy.bitwise_xor.reduce(wordHashes(indices, words)))
+
+
+# Position hash to a color, bright enough to see on the panel
+def positionColors(xs, ys):
+    h = (xs.astype(numpy.uint32) * numpy.uint32(0x9E3779B1)) ^ (ys.astype(numpy.uint32) * numpy.uint32(0x85EBCA77))
+    h ^= h >> numpy.uint32(15)
+    h *= numpy.uint32(0x2C1B3C6D)
+    h ^= h >> numpy.uint32(13)
+    colors = numpy.empty(xs.shape + (3,), dtype=numpy.uint8)
+    colors[..., 0] = (h & numpy.uint32(0x7F)) + 64
+    colors[..., 1] = ((h >> numpy.uint32(8)) & numpy.uint32(0x7F)) + 64
+    colors[..., 2] = ((h >> numpy.uint32(16)) & numpy.uint32(0x7F)) + 64
+    return colors
+
+
+# Cell (x, y) of the n-th live cell, row by row, without listing them all
+class BitLocations:
+    def __init__(self, engine):
+        self.engine = engine
+        self.counts = numpy.cumsum(wordCounts(engine.board.ravel()))
+
+    def __len__(self):
+        return int(self.counts[-1]) if len(self.counts) else 0
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        word = int(numpy.searchsorted(self.counts, index, side="right"))
+        before = int(self.counts[word - 1]) if word else 0
+        bits = int(self.engine.board.ravel()[word])
+        for skip in range(index - before):
+            bits &= bits - 1
+        bit = (bits & -bits).bit_length() - 1
+        y, wordX = divmod(word, self.engine.words)
+        return wordX * WORD_BITS + bit, y
+
+
+class BitboardEngine:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.words = (width + WORD_BITS - 1) // WORD_BITS
+        self.board = numpy.zeros((height, self.words), dtype=numpy.uint64)
+        self.nextBoard = numpy.zeros_like(self.board)
+        self.hash = 0
+
+        # Bits of the last word that are inside the world
+        lastBits = width - (self.words - 1) * WORD_BITS
+        self.lastMask = numpy.uint64((1 << lastBits) - 1)
+
+    def seedRandom(self, percent=SEED_PERCENT):
+        rng = numpy.random.default_rng(random.getrandbits(64))
+        for start in range(0, self.height, BAND_ROWS):
+            end = min(start + BAND_ROWS, self.height)
+            cells = rng.random((end - start, self.words * WORD_BITS)) < percent / 100.0
+            self.board[start:end] |= numpy.packbits(cells, axis=1, bitorder="little").view(numpy.uint64)
+        self.board[:, -1] &= self.lastMask
+        self.hash = self.boardHash()
+
+    def boardHash(self) -> int:
+        words = self.board.ravel()
+        return xorWordHashes(numpy.arange(len(words), dtype=numpy.uint64), words)
+
+    # Horizontal neighbors across word boundaries: the bit for column x
+    #  holding column x - 1 (west) or x + 1 (east)
+    def west(self, rows):
+        shifted = rows << ONE
+        shifted[:, 1:] |= rows[:, :-1] >> TOP_BIT
+        return shifted
+
+    def east(self, rows):
+        shifted = rows >> ONE
+        shifted[:, :-1] |= rows[:, 1:] << TOP_BIT
+        return shifted
+
+    def tick(self):
+        board = self.board
+        nextBoard = self.nextBoard
+        zeroRow = numpy.zeros((1, self.words), dtype=numpy.uint64)
+        for start in range(0, self.height, BAND_ROWS):
+            end = min(start + BAND_ROWS, self.height)
+
+            # The band with a row of context above and below
+            above = board[start - 1:start] if start > 0 else zeroRow
+            below = board[end:end + 1] if end < self.height else zeroRow
+            rows = numpy.concatenate((above, board[start:end], below))
+
+            west = self.west(rows)
+            east = self.east(rows)
+
+            # West + center + east of every row as a two bit number
+            sum0 = west ^ rows ^ east
+            sum1 = (west & rows) | (east & (west ^ rows))
+            # West + east of the band's own rows
+            side0 = west[1:-1] ^ east[1:-1]
+            side1 = west[1:-1] & east[1:-1]
+
+            # Neighbors = above + side + below. Bit 0 of the count and the
+            #  four bits that add up to its bit 1 and up
+            up0 = sum0[:-2]
+            down0 = sum0[2:]
+            count0 = up0 ^ side0 ^ down0
+            carry0 = (up0 & side0) | (down0 & (up0 ^ side0))
+
+            up1 = sum1[:-2]
+            down1 = sum1[2:]
+            pairA = up1 ^ side1
+            pairB = down1 ^ carry0
+            count1 = pairA ^ pairB
+            # Two or more of the four set means four neighbors or more
+            fourPlus = (up1 & side1) | (down1 & carry0) | (pairA & pairB)
+
+            # Exactly 3, or exactly 2 and alive
+            live = board[start:end]
+            nextBoard[start:end] = count1 & ~fourPlus & (count0 | live)
+
+        nextBoard[:, -1] &= self.lastMask
+
+        # Swap the changed words' hashes
+        oldWords = board.ravel()
+        newWords = nextBoard.ravel()
+        changed = numpy.flatnonzero(oldWords != newWords).astype(numpy.uint64)
+        self.hash ^= xorWordHashes(changed, oldWords[changed]) ^ xorWordHashes(changed, newWords[changed])
+
+        self.board, self.nextBoard = nextBoard, board
+
+    def stateHash(self):
+        return self.hash
+
+    def isLive(self, x, y):
+        return bool((int(self.board[y, x // WORD_BITS]) >> (x % WORD_BITS)) & 1)
+
+    def setLive(self, x, y):
+        wordX = x // WORD_BITS
+        index = numpy.array([y * self.words + wordX], dtype=numpy.uint64)
+        oldWord = self.board[y, wordX:wordX + 1].copy()
+        self.board[y, wordX] |= numpy.uint64(1 << (x % WORD_BITS))
+        self.hash ^= xorWordHashes(index, oldWord) ^ xorWordHashes(index, self.board[y, wordX:wordX + 1])
+
+    def getLiveCount(self):
+        return popcount(self.board)
+
+    def getLiveLocations(self):
+        return BitLocations(self)
+
+    def getRegion(self, ulX, ulY, colsX, rowsY):
+        firstWord = ulX // WORD_BITS
+        lastWord = (ulX + colsX - 1) // WORD_BITS + 1
+        rows = numpy.ascontiguousarray(self.board[ulY:ulY + rowsY, firstWord:lastWord])
+        bits = numpy.unpackbits(rows.view(numpy.uint8), axis=1, bitorder="little")
+        offset = ulX - firstWord * WORD_BITS
+        mask = bits[:, offset:offset + colsX].astype(bool)
+
+        ys, xs = numpy.indices(mask.shape)
+        colors = positionColors(xs + ulX, ys + ulY)
+        colors[~mask] = 0
+        return mask, colors
@@ -2,30 +2,23 @@
 
 import random
 from time import sleep
-import pika
-import json
 from pprint import pprint
+import argparse
+import sys
+import os
+import numpy
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../ScreenServer'))
+import mazergb
+import screenFrame
+import framePacer
+import numpyLife
+import bitboardLife
+import hashLife
+import lifeHash
 
 
-# ****************************************************************************
-class Pixel:
-    def __init__(self, x, y, r, g, b):
-        self.x = x
-        self.y = y
-        self.r = r
-        self.g = g
-        self.b = b
-    
-    def getDat(self):
-        dat = {
-            "coordinate": {"x": self.x, "y": self.y},
-            "color": {"r": self.r, "g": self.g, "b": self.b}
-        }
-        return dat
-
-    def __str__(self):
-        return json.dumps(self.getDat())
-
 # ****************************************************************************
 class Color:
     def __init__(self, r, g, b):
@@ -80,45 +73,29 @@ class Dead(Cell):
         return True
 
 
-class World:
-    def __init__(self, maxx=32, maxy=32):
+DEAD_COLOR = Color(0, 0, 0)
+
+
+# ****************************************************************************
+# World engines hold the board and compute generations, all with the same
+#  bounded edge rules: cells past the edge count as dead
+#  The original engine, a column major grid of Cell objects
+#  A cell can only change when something in its neighborhood changed the
+#  generation before, so only the cells around the last changes (and the
+#  ones set since) are evaluated, and updated in place. Live cells' ages
+#  are counted from their birth generation when they are handed out. The
+#  board's Zobrist hash is updated with the same births and deaths.
+class CellEngine:
+    def __init__(self, maxx, maxy):
         self._maxx = maxx
         self._maxy = maxy
         self._cells = self._createDeadCells()
-        self._maxHashes = 10
-        self._hashHistory = []
-        self._gliderChance = 5
-
-    def _calcHash(self):
-        currStr = ""
-        for x in range(self._maxx):
-            for y in range(self._maxy):
-                currStr += str(self._cells[x][y])
-        return currStr
-
-    def __str__(self):
-        ret = ""
-        for y in range(self._maxy):
-            ret += "|"
-            for x in range(self._maxx):
-                ret += str(self._cells[x][y])
-            ret += "\n"
-
-        return ret
-
-    def getLiveCount(self):
-        count = 0
-        for col in self._cells:
-            for cell in col:
-                if cell.isLive():
-                    count += 1
-        return count
-
-    def seedRandom(self):
-        for x in range(self._maxx):
-            for y in range(self._maxy):
-                if random.randrange(100) > 90:
-                    self._cells[x][y] = Live()
+        self._generation = 0
+        self._liveCount = 0
+        self._hash = 0
+        self._active = set()        # cells changed by the last generation or set since
+        self._changed = set()       # cells changed since takeChanges, for delta frames
+        self.lastChanges = ([], [])     # births and deaths of the last generation
 
     def _isValidX(self, x):
         if x >= 0 and x < self._maxx:
@@ -158,36 +135,178 @@ class World:
             newCells.append(newCol)
         return newCells
 
+    def stateHash(self):
+        return self._hash
 
-    def _updateHashHistory(self):
-        currHash = self._calcHash()
-        self._hashHistory.append(currHash)
-        if len(self._hashHistory) > self._maxHashes:
-            self._hashHistory.pop(0)
+    def _cellKey(self, x, y):
+        return lifeHash.cellKey(y * self._maxx + x)
+
+    def isLive(self, x, y):
+        return self._cells[x][y].isLive()
 
+    def setLive(self, x, y):
+        if not self._cells[x][y].isLive():
+            self._liveCount += 1
+            self._hash ^= self._cellKey(x, y)
+        cell = Live()
+        cell.birth = self._generation
+        self._cells[x][y] = cell
+        self._active.add((x, y))
+        self._changed.add((x, y))
 
-    def getHistoryDiversityScore(self):
-        score = 0
-        hashes = {}
-        for hash in self._hashHistory:
-            hashes[hash] = 1
-        for key, value in hashes.items():
-            score += value
-        return score
+    def getCell(self, x, y):
+        cell = self._cells[x][y]
+        if cell.isLive():
+            cell.age = self._generation - cell.birth
+        return cell
+
+    def getLiveCount(self):
+        return self._liveCount
+
+    def takeChanges(self):
+        changed = self._changed
+        self._changed = set()
+        return changed
+
+    def getLiveLocations(self):
+        liveLocs = []
+        for x in range(self._maxx):
+            for y in range(self._maxy):
+                if self._cells[x][y].isLive():
+                    liveLocs.append((x,y))
+        return liveLocs
 
+    # (rows, cols) live mask and (rows, cols, 3) colors of a region
+    def getRegion(self, ulX, ulY, colsX, rowsY):
+        mask = numpy.zeros((rowsY, colsX), dtype=bool)
+        colors = numpy.zeros((rowsY, colsX, 3), dtype=numpy.uint8)
+        for x in range(colsX):
+            for y in range(rowsY):
+                cell = self._cells[ulX + x][ulY + y]
+                if cell.isLive():
+                    color = cell.getColor()
+                    mask[y, x] = True
+                    colors[y, x] = (color.r, color.g, color.b)
+        return mask, colors
 
     def tick(self):
-        oldCells = self._cells
-        newCells = self._createDeadCells()
+        candidates = set()
+        for x, y in self._active:
+            for currX in range(max(x - 1, 0), min(x + 2, self._maxx)):
+                for currY in range(max(y - 1, 0), min(y + 2, self._maxy)):
+                    candidates.add((currX, currY))
+
+        cells = self._cells
+        births = []
+        deaths = []
+        for x, y in candidates:
+            neighborCount = self._getLiveNeighborCount(x, y)
+            if cells[x][y].isLive():
+                if neighborCount not in [2, 3]:
+                    deaths.append((x, y))
+            elif neighborCount == 3:    # Create new cell
+                births.append((x, y))
+
+        # Survivors keep their cell (inc color!), births come in the order
+        #  of a full scan so their colors are drawn from random in that order
+        self._generation += 1
+        births.sort()
+        for x, y in deaths:
+            cells[x][y] = Dead(DEAD_COLOR)
+        for x, y in births:
+            cell = Live()
+            cell.birth = self._generation
+            cells[x][y] = cell
+
+        self._liveCount += len(births) - len(deaths)
+        for x, y in births + deaths:
+            self._hash ^= self._cellKey(x, y)
+        self._active = set(births)
+        self._active.update(deaths)
+        self._changed |= self._active
+        self.lastChanges = (births, deaths)
+
+
+ENGINES = {
+    "cells": CellEngine,
+    "numpy": numpyLife.NumpyEngine,
+    "bitboard": bitboardLife.BitboardEngine,
+    "hashlife": hashLife.HashLifeEngine,
+}
+
+
+# ****************************************************************************
+class World:
+    def __init__(self, maxx=32, maxy=32, engine="cells"):
+        self._maxx = maxx
+        self._maxy = maxy
+        self._engine = ENGINES[engine](maxx, maxy)
+        self._generation = 0
+        self._cycles = lifeHash.CycleDetector()
+        self._gliderChance = 5
+
+    def _calcHash(self):
+        return self._engine.stateHash()
+
+    def __str__(self):
+        mask, colors = self._engine.getRegion(0, 0, self._maxx, self._maxy)
+        ret = ""
+        for row in mask:
+            ret += "|" + "".join('x' if live else ' ' for live in row) + "\n"
+
+        return ret
+
+    def getLiveCount(self):
+        return self._engine.getLiveCount()
+
+    def seedRandom(self):
+        if hasattr(self._engine, "seedRandom"):
+            # Huge worlds are seeded in bulk
+            self._engine.seedRandom()
+            return
         for x in range(self._maxx):
             for y in range(self._maxy):
-                neighborCount = self._getLiveNeighborCount(x, y)
-                if oldCells[x][y].isLive() and neighborCount in [2, 3]:
-                    newCells[x][y] = oldCells[x][y]     # Keep old live cell (inc color!)
-                    newCells[x][y].getOlder()           # This cell gets older (for stats & colors)
-                elif oldCells[x][y].isDead() and neighborCount == 3:    # Create new cell
-                    newCells[x][y] = Live()
-        self._cells = newCells
+                if random.randrange(100) > 90:
+                    self._engine.setLive(x, y)
+
+    def _isValidX(self, x):
+        if x >= 0 and x < self._maxx:
+            return True
+        return False
+
+    def _isValidY(self, y):
+        if y >= 0 and y < self._maxy:
+            return True
+        return False
+
+    def _isValidLoc(self, x, y):
+        return self._isValidX(x) and self._isValidY(y)
+
+
+    def _updateHashHistory(self):
+        self._cycles.update(self._calcHash(), self._generation)
+
+
+    # Period of the still life / oscillator the world is in, None if not stuck
+    def getCyclePeriod(self):
+        return self._cycles.period
+
+
+    def tick(self):
+        self._engine.tick()
+        self._generation += 1
+
+        self._updateHashHistory()
+
+
+    # Jumps generations ahead, in one go on engines that can (HashLife)
+    def fastForward(self, generations):
+        if hasattr(self._engine, "advance"):
+            self._engine.advance(generations)
+        else:
+            for generation in range(generations):
+                self._engine.tick()
+        self._generation += generations
 
         self._updateHashHistory()
 
@@ -196,11 +315,7 @@ class World:
         if self.getLiveCount() < 1:
             return  # No one alive - should reset anyway
 
-        liveLocs = []
-        for x in range(self._maxx):
-            for y in range(self._maxy):
-                if self._cells[x][y].isLive():
-                    liveLocs.append((x,y))
+        liveLocs = self._engine.getLiveLocations()
         selectedLoc = liveLocs[random.randrange(len(liveLocs))]
         selectedLiveX = selectedLoc[0]
         selectedLiveY = selectedLoc[1]
@@ -214,46 +329,47 @@ class World:
         selectedNewLiveY = selectedLiveY + neighYOffset
         
         # Create new neighbor cell for some fireworks!
-        self._cells[selectedNewLiveX][selectedNewLiveY] = Live()
+        self._engine.setLive(selectedNewLiveX, selectedNewLiveY)
 
     def _createRandomGlider(self):
         #print("Creating glider!")
+        setLive = self._engine.setLive
         quadrant = random.randrange(4)
         if quadrant == 0:  # upper left
             #print("Upper left!")
-            self._cells[1][0] = Live()
-            self._cells[2][1] = Live()
-            self._cells[0][2] = Live()
-            self._cells[1][2] = Live()
-            self._cells[2][2] = Live()
+            setLive(1, 0)
+            setLive(2, 1)
+            setLive(0, 2)
+            setLive(1, 2)
+            setLive(2, 2)
         elif quadrant == 1: # upper right
             #print("Upper right!")
-            self._cells[self._maxx - 2][0] = Live()
-            self._cells[self._maxx - 3][1] = Live()
-            self._cells[self._maxx - 3][2] = Live()
-            self._cells[self._maxx - 2][2] = Live()
-            self._cells[self._maxx - 1][2] = Live()
+            setLive(self._maxx - 2, 0)
+            setLive(self._maxx - 3, 1)
+            setLive(self._maxx - 3, 2)
+            setLive(self._maxx - 2, 2)
+            setLive(self._maxx - 1, 2)
         elif quadrant == 2: # lower left 
             #print("lower left!")
-            self._cells[0][self._maxy - 3] = Live()
-            self._cells[1][self._maxy - 3] = Live()
-            self._cells[2][self._maxy - 3] = Live()
-            self._cells[2][self._maxy - 2] = Live()
-            self._cells[1][self._maxy - 1] = Live()
+            setLive(0, self._maxy - 3)
+            setLive(1, self._maxy - 3)
+            setLive(2, self._maxy - 3)
+            setLive(2, self._maxy - 2)
+            setLive(1, self._maxy - 1)
         elif quadrant == 3: # lower left 
             #print("lower right!")
-            self._cells[self._maxx - 3][self._maxy - 3] = Live()
-            self._cells[self._maxx - 2][self._maxy - 3] = Live()
-            self._cells[self._maxx - 1][self._maxy - 3] = Live()
-            self._cells[self._maxx - 3][self._maxy - 2] = Live()
-            self._cells[self._maxx - 2][self._maxy - 1] = Live()
+            setLive(self._maxx - 3, self._maxy - 3)
+            setLive(self._maxx - 2, self._maxy - 3)
+            setLive(self._maxx - 1, self._maxy - 3)
+            setLive(self._maxx - 3, self._maxy - 2)
+            setLive(self._maxx - 2, self._maxy - 1)
         #print("Glider created")
         
             
 
 
     def handleStuck(self):
-        if self.getHistoryDiversityScore() < 3:
+        if self.getCyclePeriod() is not None:
             self.injectRandomNewNeighbor()
         if self.getLiveCount() < 2:
             self.seedRandom()
@@ -262,6 +378,9 @@ class World:
             self._createRandomGlider()
 
     def getScreenCells(self, ulX, ulY, colsX, rowsY):
+        if not isinstance(self._engine, CellEngine):
+            return self._makeScreenCells(ulX, ulY, colsX, rowsY)
+
         screenCells = []
         for y in range(rowsY):
             newCol = []
@@ -271,68 +390,42 @@ class World:
 
         for x in range(colsX):
             for y in range(rowsY):
-                screenCells[x][y] = self._cells[ulX + x][ulY + y]
+                screenCells[x][y] = self._engine.getCell(ulX + x, ulY + y)
 
         return screenCells
 
+    # Engines other than the Cell one keep no Cell objects, make them
+    def _makeScreenCells(self, ulX, ulY, colsX, rowsY):
+        mask, colors = self._engine.getRegion(ulX, ulY, colsX, rowsY)
+        screenCells = []
+        for x in range(colsX):
+            newCol = []
+            for y in range(rowsY):
+                if mask[y, x]:
+                    newCol.append(Live(Color(*colors[y, x].tolist())))
+                else:
+                    newCol.append(Dead(DEAD_COLOR))
+            screenCells.append(newCol)
+        return screenCells
 
+    # Screen pixels (row major offsets) that changed since the last call,
+    #  None when the engine keeps no change list
+    def takeScreenChanges(self, ulX, ulY, colsX, rowsY):
+        if not hasattr(self._engine, "takeChanges"):
+            return None
+        changes = []
+        for x, y in self._engine.takeChanges():
+            if ulX <= x < ulX + colsX and ulY <= y < ulY + rowsY:
+                changes.append((y - ulY) * colsX + x - ulX)
+        return changes
 
-    
+    def getScreenFrame(self, ulX, ulY, colsX, rowsY):
+        mask, colors = self._engine.getRegion(ulX, ulY, colsX, rowsY)
+        return screenFrame.Frame.fromMask(mask, colors)
 
-# ****************************************************************************
-class RMQWrapper():
-    def __init__(self):
-        print("Connecting to RMQ server -- ", end='')
-        self.queueName = "MazeScreen"
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host='localhost'))
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(queue=self.queueName)
-        print("Connected.")
-
-    def publish(self, msg):
-        self.channel.basic_publish(exchange='', routing_key=self.queueName, body=msg)
-
-    def close(self):
-        self.connection.close()
-
-    def sendClear(self):
-        dat = {"type": "clear"}
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-    def sendScreenCells(self, screenCells):
-        self.sendClear()
-        for x in range(len(screenCells)):
-            for y in range(len(screenCells[0])):
-                if screenCells[x][y].isLive():
-                    cell = screenCells[x][y]
-                    color = cell.getColor()
-                    pixel = Pixel(x, y, color.r, color.g, color.b)
-                    dat = {
-                        "type": "drawPixel",
-                        "pixel": pixel.getDat()
-                    }
-                    msg = json.dumps(dat)
-                    #print(msg)
-                    self.publish(msg)
-
-    def sendScreenCellsRedraw(self, screenCells):
-        dat = {
-            "type": "redraw",
-            "pixels": []
-            }
-        for x in range(len(screenCells)):
-            for y in range(len(screenCells[0])):
-                if screenCells[x][y].isLive():
-                    cell = screenCells[x][y]
-                    color = cell.getColor()
-                    pixel = Pixel(x, y, color.r, color.g, color.b)
-                    dat["pixels"].append(pixel.getDat())
-        msg = json.dumps(dat)
-        self.publish(msg)
 
 
+    
 
 # ****************************************************************************
 def cls():
@@ -340,21 +433,41 @@ def cls():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", action="store", help="World engine. Default: cells", choices=list(ENGINES), default="cells")
+    parser.add_argument("--world-size", action="store", help="Edge of the square world the screen shows the middle of. Default: 38", default=38, type=int)
+    parser.add_argument("--fast-forward", action="store", help="Generations to skip after seeding, fastest with --engine hashlife. Default: 0", default=0, type=int)
+    args = parser.parse_args()
+
     print("Starting game of life")
-    rmq = RMQWrapper()
-    rmq.sendClear()
+    client = mazergb.ScreenClient("life", fps=1.0)
+    client.sendClear()
 
-    world = World(maxx=38, maxy=38)
+    world = World(maxx=args.world_size, maxy=args.world_size, engine=args.engine)
+    screenX = (args.world_size - 32) // 2
     world.seedRandom()
+    if args.fast_forward:
+        world.fastForward(args.fast_forward)
+    pacer = framePacer.FramePacer("life")
     while True:
-        cls()
-        print(world)
+        if client.paused:
+            # Another channel is on screen, don't spend the CPU on unseen generations
+            sleep(1)
+            pacer.reset()
+            continue
+
+        if args.world_size <= 80:
+            cls()
+            print(world)
         world.tick()
         world.handleStuck()
 
-        screenCells = world.getScreenCells(3, 3, 32, 32)
-        rmq.sendScreenCellsRedraw(screenCells)
+        # The world keeps going while the server is behind, only sending waits
+        if not client.rate.shouldSkip():
+            frame = world.getScreenFrame(screenX, screenX, 32, 32)
+            changed = world.takeScreenChanges(screenX, screenX, 32, 32)
+            client.sendDelta(frame.width, frame.height, frame.tobytes(), changed=changed)
 
-        sleep(1)
+        pacer.wait(client.rate.interval())
 
     print("Game done.")
@@ -0,0 +1,360 @@
+#
+# HashLife engine for the Game of Life World
+#  The universe is a quadtree of canonical nodes: every distinct square of
+#  cells exists once, so repeated and empty areas cost nothing. A node of
+#  level L is 2^L cells on a side and memoizes its center square advanced
+#  2^j generations (j <= L - 2), which lets step(2 ** k) jump thousands of
+#  generations in about the time of a few.
+#
+#  Cells past the World's edges count as dead, like in the other engines:
+#  after every jump the cells that left the World are cleared. A jump of 2^k
+#  generations is only taken while the pattern is 2^k cells or more inside
+#  the edges, where it cannot reach them and the jump is exact, so next to
+#  the edges the engine goes a generation at a time. Live cells take a color
+#  hashed from their position, like in the bitboard engine.
+#
+#  Memory is bounded by maxNodes: past it, the canonical table is rebuilt
+#  from the nodes still reachable from the root and the results are dropped.
+#
+#  Every node also carries a polynomial hash of its cells, the sum of
+#  HASH_X^x * HASH_Y^y over its live cells modulo a prime, so the board's
+#  hash comes from the root's without visiting cells and does not depend on
+#  how the root lines up with the World.
+#
+
+import numpy
+
+from bitboardLife import positionColors
+
+DEFAULT_MAX_NODES = 1 << 19
+
+HASH_PRIME = (1 << 61) - 1
+HASH_X = 0x2545F4914F6CDD1D % HASH_PRIME
+HASH_Y = 0x9E3779B97F4A7C15 % HASH_PRIME
+
+
+class Node:
+    __slots__ = ("level", "nw", "ne", "sw", "se", "population", "key")
+
+    def __init__(self, level, nw, ne, sw, se, population, key):
+        self.level = level
+        self.nw = nw
+        self.ne = ne
+        self.sw = sw
+        self.se = se
+        self.population = population
+        self.key = key      # hash of the cells relative to the top left one
+
+
+OFF = Node(0, None, None, None, None, 0, 0)
+ON = Node(0, None, None, None, None, 1, 1)
+
+# HASH_X and HASH_Y to the power of 2^level: moves a key a node's size
+SHIFTS_X = []
+SHIFTS_Y = []
+
+
+def hashShifts(level):
+    while len(SHIFTS_X) <= level:
+        size = 1 << len(SHIFTS_X)
+        SHIFTS_X.append(pow(HASH_X, size, HASH_PRIME))
+        SHIFTS_Y.append(pow(HASH_Y, size, HASH_PRIME))
+    return SHIFTS_X[level], SHIFTS_Y[level]
+
+
+# The n-th live cell, quadrant by quadrant, found through the populations
+class NodeLocations:
+    def __init__(self, engine):
+        self.root = engine.root
+        self.originX = engine.originX
+        self.originY = engine.originY
+
+    def __len__(self):
+        return self.root.population
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        node = self.root
+        x = self.originX
+        y = self.originY
+        while node.level > 0:
+            half = 1 << (node.level - 1)
+            for child, offsetX, offsetY in ((node.nw, 0, 0), (node.ne, half, 0), (node.sw, 0, half), (node.se, half, half)):
+                if index < child.population:
+                    node = child
+                    x += offsetX
+                    y += offsetY
+                    break
+                index -= child.population
+        return x, y
+
+
+class HashLifeEngine:
+    def __init__(self, width, height, maxNodes=DEFAULT_MAX_NODES):
+        self.width = width
+        self.height = height
+        self.maxNodes = maxNodes
+        self.table = {}
+        self.results = {}
+        self.empties = [OFF]
+        self.generation = 0
+
+        # World coordinates of the root's top left cell
+        level = 3
+        while (1 << level) < max(width, height):
+            level += 1
+        self.root = self.empty(level)
+        self.originX = 0
+        self.originY = 0
+
+    # ************************************************************************
+    # Canonical nodes
+    def join(self, nw, ne, sw, se):
+        key = (nw, ne, sw, se)
+        node = self.table.get(key)
+        if node is None:
+            shiftX, shiftY = hashShifts(nw.level)
+            cellsKey = (nw.key + shiftX * ne.key + shiftY * (sw.key + shiftX * se.key)) % HASH_PRIME
+            node = Node(nw.level + 1, nw, ne, sw, se, nw.population + ne.population + sw.population + se.population, cellsKey)
+            self.table[key] = node
+        return node
+
+    def empty(self, level):
+        while len(self.empties) <= level:
+            smaller = self.empties[-1]
+            self.empties.append(self.join(smaller, smaller, smaller, smaller))
+        return self.empties[level]
+
+    def center(self, node):
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+    # Same node one level up, in the middle of empty space
+    def expand(self):
+        root = self.root
+        border = self.empty(root.level - 1)
+        self.root = self.join(self.join(border, border, border, root.nw),
+                              self.join(border, border, root.ne, border),
+                              self.join(border, root.sw, border, border),
+                              self.join(root.se, border, border, border))
+        shift = 1 << (root.level - 1)
+        self.originX -= shift
+        self.originY -= shift
+
+    # True when every live cell is in the root's middle quarter
+    def isPadded(self):
+        root = self.root
+        return (root.nw.population == root.nw.se.se.population
+                and root.ne.population == root.ne.sw.sw.population
+                and root.sw.population == root.sw.ne.ne.population
+                and root.se.population == root.se.nw.nw.population)
+
+    def collect(self):
+        self.results.clear()
+        table = {}
+        pending = [self.root] + self.empties[1:]
+        while pending:
+            node = pending.pop()
+            if node.level == 0:
+                continue
+            key = (node.nw, node.ne, node.sw, node.se)
+            if key in table:
+                continue
+            table[key] = node
+            pending.extend(key)
+        self.table = table
+
+    # ************************************************************************
+    # Evolution
+    def life4x4(self, node):
+        cells = [[0] * 4 for row in range(4)]
+        for quadrant, qx, qy in ((node.nw, 0, 0), (node.ne, 2, 0), (node.sw, 0, 2), (node.se, 2, 2)):
+            cells[qy][qx] = quadrant.nw.population
+            cells[qy][qx + 1] = quadrant.ne.population
+            cells[qy + 1][qx] = quadrant.sw.population
+            cells[qy + 1][qx + 1] = quadrant.se.population
+
+        nextCells = []
+        for y in (1, 2):
+            for x in (1, 2):
+                count = sum(cells[y + dy][x + dx] for dy in (-1, 0, 1) for dx in (-1, 0, 1)) - cells[y][x]
+                nextCells.append(ON if count == 3 or (count == 2 and cells[y][x]) else OFF)
+        return self.join(*nextCells)
+
+    # Center of node (one level down) advanced 2^j generations
+    def successor(self, node, j):
+        if node.population == 0:
+            return self.empty(node.level - 1)
+        j = min(j, node.level - 2)
+        key = (node, j)
+        result = self.results.get(key)
+        if result is not None:
+            return result
+
+        if node.level == 2:
+            result = self.life4x4(node)
+        else:
+            nw = node.nw
+            ne = node.ne
+            sw = node.sw
+            se = node.se
+            c1 = self.successor(nw, j)
+            c2 = self.successor(self.join(nw.ne, ne.nw, nw.se, ne.sw), j)
+            c3 = self.successor(ne, j)
+            c4 = self.successor(self.join(nw.sw, nw.se, sw.nw, sw.ne), j)
+            c5 = self.successor(self.join(nw.se, ne.sw, sw.ne, se.nw), j)
+            c6 = self.successor(self.join(ne.sw, ne.se, se.nw, se.ne), j)
+            c7 = self.successor(sw, j)
+            c8 = self.successor(self.join(sw.ne, se.nw, sw.se, se.sw), j)
+            c9 = self.successor(se, j)
+
+            if j < node.level - 2:
+                # The nine are far enough along, stitch their centers
+                result = self.join(self.join(c1.se, c2.sw, c4.ne, c5.nw),
+                                   self.join(c2.se, c3.sw, c5.ne, c6.nw),
+                                   self.join(c4.se, c5.sw, c7.ne, c8.nw),
+                                   self.join(c5.se, c6.sw, c8.ne, c9.nw))
+            else:
+                # Full speed: a second round of the same jump
+                result = self.join(self.successor(self.join(c1, c2, c4, c5), j),
+                                   self.successor(self.join(c2, c3, c5, c6), j),
+                                   self.successor(self.join(c4, c5, c7, c8), j),
+                                   self.successor(self.join(c5, c6, c8, c9), j))
+        self.results[key] = result
+        return result
+
+    # Advances 2^k generations
+    def step(self, k=0):
+        # Room for the pattern to grow 2^k cells every way without leaving
+        #  the center square the successor returns
+        while self.root.level < k + 3 or not self.isPadded():
+            self.expand()
+        self.expand()
+
+        shift = 1 << (self.root.level - 2)
+        self.root = self.successor(self.root, k)
+        self.originX += shift
+        self.originY += shift
+        self.generation += 1 << k
+
+        if len(self.table) > self.maxNodes or len(self.results) > self.maxNodes:
+            self.collect()
+
+    # Node at world (x, y) without the cells outside the World
+    def clip(self, node, x, y):
+        size = 1 << node.level
+        if node.population == 0 or (x >= 0 and y >= 0 and x + size <= self.width and y + size <= self.height):
+            return node
+        if x >= self.width or y >= self.height or x + size <= 0 or y + size <= 0:
+            return self.empty(node.level)
+        half = size >> 1
+        return self.join(self.clip(node.nw, x, y), self.clip(node.ne, x + half, y),
+                         self.clip(node.sw, x, y + half), self.clip(node.se, x + half, y + half))
+
+    # Live cells of the node at world (x, y) inside the given rectangle
+    def countInside(self, node, x, y, left, top, right, bottom):
+        size = 1 << node.level
+        if node.population == 0 or x >= right or y >= bottom or x + size <= left or y + size <= top:
+            return 0
+        if x >= left and y >= top and x + size <= right and y + size <= bottom:
+            return node.population
+        half = size >> 1
+        return (self.countInside(node.nw, x, y, left, top, right, bottom)
+                + self.countInside(node.ne, x + half, y, left, top, right, bottom)
+                + self.countInside(node.sw, x, y + half, left, top, right, bottom)
+                + self.countInside(node.se, x + half, y + half, left, top, right, bottom))
+
+    # True when every live cell is at least margin cells inside the edges
+    def isInside(self, margin):
+        inside = self.countInside(self.root, self.originX, self.originY,
+                                  margin, margin, self.width - margin, self.height - margin)
+        return inside == self.root.population
+
+    def advance(self, generations):
+        while generations:
+            k = generations.bit_length() - 1
+            while k and not self.isInside(1 << k):
+                k -= 1
+            self.step(k)
+            self.root = self.clip(self.root, self.originX, self.originY)
+            generations -= 1 << k
+
+    def tick(self):
+        self.advance(1)
+
+    # ************************************************************************
+    # Cells
+    def contains(self, x, y):
+        size = 1 << self.root.level
+        return self.originX <= x < self.originX + size and self.originY <= y < self.originY + size
+
+    def setCell(self, node, x, y, alive):
+        if node.level == 0:
+            return ON if alive else OFF
+        half = 1 << (node.level - 1)
+        nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+        if y < half:
+            if x < half:
+                nw = self.setCell(nw, x, y, alive)
+            else:
+                ne = self.setCell(ne, x - half, y, alive)
+        else:
+            if x < half:
+                sw = self.setCell(sw, x, y - half, alive)
+            else:
+                se = self.setCell(se, x - half, y - half, alive)
+        return self.join(nw, ne, sw, se)
+
+    def setLive(self, x, y):
+        while not self.contains(x, y):
+            self.expand()
+        self.root = self.setCell(self.root, x - self.originX, y - self.originY, True)
+
+    def isLive(self, x, y):
+        if not self.contains(x, y):
+            return False
+        node = self.root
+        x -= self.originX
+        y -= self.originY
+        while node.level > 0:
+            half = 1 << (node.level - 1)
+            if y < half:
+                node = node.nw if x < half else node.ne
+            else:
+                node = node.sw if x < half else node.se
+            x %= half
+            y %= half
+        return node is ON
+
+    def getLiveCount(self):
+        return self.root.population
+
+    def getLiveLocations(self):
+        return NodeLocations(self)
+
+    # The root's key moved to its place in the World
+    def stateHash(self):
+        return pow(HASH_X, self.originX, HASH_PRIME) * pow(HASH_Y, self.originY, HASH_PRIME) * self.root.key % HASH_PRIME
+
+    def fillRegion(self, mask, node, x, y, ulX, ulY):
+        size = 1 << node.level
+        rowsY, colsX = mask.shape
+        if node.population == 0 or x >= ulX + colsX or y >= ulY + rowsY or x + size <= ulX or y + size <= ulY:
+            return
+        if node.level == 0:
+            mask[y - ulY, x - ulX] = True
+            return
+        half = size >> 1
+        self.fillRegion(mask, node.nw, x, y, ulX, ulY)
+        self.fillRegion(mask, node.ne, x + half, y, ulX, ulY)
+        self.fillRegion(mask, node.sw, x, y + half, ulX, ulY)
+        self.fillRegion(mask, node.se, x + half, y + half, ulX, ulY)
+
+    def getRegion(self, ulX, ulY, colsX, rowsY):
+        mask = numpy.zeros((rowsY, colsX), dtype=bool)
+        self.fillRegion(mask, self.root, self.originX, self.originY, ulX, ulY)
+
+        ys, xs = numpy.indices(mask.shape)
+        colors = positionColors(xs + ulX, ys + ulY)
+        colors[~mask] = 0
+        return mask, colors
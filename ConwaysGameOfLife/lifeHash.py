@@ -0,0 +1,81 @@
+#
+# Board hashes and cycle detection for the Game of Life World
+#  A board's hash is the XOR of a 64 bit key per live cell (Zobrist
+#  hashing), so a generation only XORs in the keys of the cells that were
+#  born or died. Keys come from splitmix64 of the cell's row major index
+#  rather than a table, so huge worlds cost nothing until cells change.
+#  The bitboard and HashLife engines hash by word and by node instead, see
+#  their modules.
+#
+#  CycleDetector maps each hash to the generation it was last seen at: a
+#  board seen before means a still life or oscillator, of whatever period
+#  fits in its history.
+#
+#  e.g. a blinker:
+#    detector = lifeHash.CycleDetector()
+#    detector.update(hashA, 1); detector.update(hashB, 2); detector.update(hashA, 3)  # -> 2
+#
+
+from collections import deque
+
+import numpy
+
+MASK64 = (1 << 64) - 1
+DEFAULT_HISTORY = 10000     # generations a repeat is looked for in
+
+GOLDEN = numpy.uint64(0x9E3779B97F4A7C15)
+MIX1 = numpy.uint64(0xBF58476D1CE4E5B9)
+MIX2 = numpy.uint64(0x94D049BB133111EB)
+
+
+# Key of one cell, the same as cellKeys gives
+def cellKey(index: int) -> int:
+    z = (index + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+# splitmix64 of every value of a uint64 array, wrapping like the scalar one
+def splitmix64(values):
+    z = values.astype(numpy.uint64) + GOLDEN
+    z = (z ^ (z >> numpy.uint64(30))) * MIX1
+    z = (z ^ (z >> numpy.uint64(27))) * MIX2
+    return z ^ (z >> numpy.uint64(31))
+
+
+def cellKeys(indices):
+    return splitmix64(numpy.asarray(indices, dtype=numpy.uint64))
+
+
+# XOR of the keys of the given cells, e.g. the ones a generation changed
+def xorKeys(indices) -> int:
+    if len(indices) == 0:
+        return 0
+    return int(numpy.bitwise_xor.reduce(cellKeys(indices)))
+
+
+class CycleDetector:
+    def __init__(self, maxHistory=DEFAULT_HISTORY):
+        self.maxHistory = maxHistory
+        self.seen = {}          # hash -> generation it was last seen at
+        self.order = deque()    # (generation, hash) oldest first, for forgetting
+        self.period = None
+
+    def clear(self):
+        self.seen.clear()
+        self.order.clear()
+        self.period = None
+
+    # Returns the generations since this board was last seen, None if new
+    def update(self, stateHash, generation):
+        last = self.seen.get(stateHash)
+        self.period = generation - last if last is not None else None
+        self.seen[stateHash] = generation
+        self.order.append((generation, stateHash))
+
+        while self.order and self.order[0][0] <= generation - self.maxHistory:
+            oldGeneration, oldHash = self.order.popleft()
+            if self.seen.get(oldHash) == oldGeneration:
+                del self.seen[oldHash]
+        return self.period
@@ -0,0 +1,102 @@
+#
+# NumPy engine for the Game of Life World
+#  The board is a (height, width) uint8 array of 0 / 1. Neighbor counts are
+#  the sum of the eight shifted copies of the board inside a zero border, so
+#  cells past the edge count as dead, like in the Cell object engine.
+#  Live cells keep the random color they were born with and age every
+#  generation they survive. The board's Zobrist hash (see lifeHash.py) is
+#  updated with the cells each generation changes.
+#
+
+import random
+
+import numpy
+
+import lifeHash
+
+
+class NumpyEngine:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.board = numpy.zeros((height, width), dtype=numpy.uint8)
+        self.colors = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+        self.ages = numpy.zeros((height, width), dtype=numpy.uint32)
+        self.rng = numpy.random.default_rng()
+        self.hash = 0
+
+        # Scratch space reused every generation
+        self.padded = numpy.zeros((height + 2, width + 2), dtype=numpy.uint8)
+        self.counts = numpy.zeros((height, width), dtype=numpy.uint8)
+        self.survive = numpy.zeros((height, width), dtype=bool)
+        self.born = numpy.zeros((height, width), dtype=bool)
+        self.changed = numpy.zeros((height, width), dtype=bool)
+
+    def neighborCounts(self):
+        padded = self.padded
+        padded[1:-1, 1:-1] = self.board
+        counts = self.counts
+        numpy.copyto(counts, padded[:-2, :-2])
+        counts += padded[:-2, 1:-1]
+        counts += padded[:-2, 2:]
+        counts += padded[1:-1, :-2]
+        counts += padded[1:-1, 2:]
+        counts += padded[2:, :-2]
+        counts += padded[2:, 1:-1]
+        counts += padded[2:, 2:]
+        return counts
+
+    def tick(self):
+        counts = self.neighborCounts()
+        board = self.board
+        live = board.view(bool)
+
+        # Survivors have 2 or 3 neighbors, births exactly 3
+        survive = self.survive
+        numpy.equal(counts, 2, out=survive)
+        survive &= live
+        born = self.born
+        numpy.equal(counts, 3, out=born)
+        survive |= born & live
+        born &= ~live
+
+        self.ages[survive] += 1
+        self.ages[born] = 0
+        births = numpy.count_nonzero(born)
+        if births:
+            self.colors[born] = self.rng.integers(0, 255, size=(births, 3), dtype=numpy.uint8)
+
+        # Deaths and births flip their cell's key in the hash
+        changed = self.changed
+        numpy.greater(live, survive, out=changed)
+        changed |= born
+        self.hash ^= lifeHash.xorKeys(numpy.flatnonzero(changed))
+
+        numpy.bitwise_or(survive, born, out=live)
+
+    def stateHash(self):
+        return self.hash
+
+    def isLive(self, x, y):
+        return bool(self.board[y, x])
+
+    # Colors come from random like the Cell's do, so seeding consumes the
+    #  same random numbers whatever the engine
+    def setLive(self, x, y):
+        if not self.board[y, x]:
+            self.hash ^= lifeHash.cellKey(y * self.width + x)
+        self.board[y, x] = 1
+        self.colors[y, x] = (random.randrange(255), random.randrange(255), random.randrange(255))
+        self.ages[y, x] = 0
+
+    def getLiveCount(self):
+        return int(numpy.count_nonzero(self.board))
+
+    # Column by column, in the order the Cell engine lists them
+    def getLiveLocations(self):
+        xs, ys = numpy.nonzero(self.board.T)
+        return list(zip(xs.tolist(), ys.tolist()))
+
+    def getRegion(self, ulX, ulY, colsX, rowsY):
+        mask = self.board[ulY:ulY + rowsY, ulX:ulX + colsX].astype(bool)
+        return mask, self.colors[ulY:ulY + rowsY, ulX:ulX + colsX]
@@ -0,0 +1,106 @@
+#
+# Producer channel multiplexer for the screen server
+#  Every producer draws on a named channel with its own virtual canvas and
+#  stream state, and only the active channel is shown. The live channels of
+#  the highest priority take turns on the panel for dwell seconds each;
+#  lower priorities only get it when no higher priority channel is around.
+#  Producers of the channels not on screen are told to pause.
+#
+
+import virtualCanvas
+
+
+# ****************************************************************************
+class ScreenChannel:
+    def __init__(self, name: str, priority: int, width: int, height: int, tileSize: int):
+        self.name = name
+        self.priority = priority
+        self.canvas = virtualCanvas.VirtualCanvas(width, height, tileSize)
+        self.streams = {}
+        self.clip = None
+
+        # Offscreen copy of canvas batched JSON ops draw on until their flush
+        self.staging = None
+        self.stagedTiles = None
+
+        self.lastMessageTime = 0.0
+        self.activeSince = None
+        self.paused = False
+        self.pauseSentTime = 0.0
+
+    def __str__(self):
+        return f"{self.name} (priority {self.priority})"
+
+
+# ****************************************************************************
+class ChannelMux:
+    def __init__(self, width: int, height: int, tileSize=8, dwell=30.0, timeout=10.0):
+        self.width = width
+        self.height = height
+        self.tileSize = tileSize
+        self.dwell = dwell
+        self.timeout = timeout
+        self.channels = {}      # in order of first message, which is the rotation order
+        self.active = None
+
+    # Returns the named channel, creating it on its first message
+    def channelFor(self, name: str, priority: int, now: float) -> ScreenChannel:
+        channel = self.channels.get(name)
+        if channel is None:
+            channel = ScreenChannel(name, priority, self.width, self.height, self.tileSize)
+            self.channels[name] = channel
+            print(f"New screen channel {channel}")
+        channel.priority = priority
+        channel.lastMessageTime = now
+        return channel
+
+    # A channel that stopped drawing while on screen is dropped, so the panel
+    #  goes to the next one instead of a frozen frame. A paused channel is
+    #  kept until its turn comes, whenever that is
+    def dropStale(self, now: float) -> None:
+        active = self.active
+        if active is None or active.clip is not None or len(self.channels) < 2:
+            return
+        if now - max(active.lastMessageTime, active.activeSince) > self.timeout:
+            print(f"Screen channel {active} went quiet, dropping it")
+            del self.channels[active.name]
+            self.active = None
+
+    def choose(self, now: float):
+        if not self.channels:
+            return None
+        topPriority = max(channel.priority for channel in self.channels.values())
+        candidates = [channel for channel in self.channels.values() if channel.priority == topPriority]
+
+        active = self.active
+        if active not in candidates:
+            return candidates[0]
+        if len(candidates) == 1 or now - active.activeSince < self.dwell:
+            return active
+        return candidates[(candidates.index(active) + 1) % len(candidates)]
+
+    # Picks the channel to show at now. Returns True when that changed, and
+    #  the pause / resume control messages for the producers
+    def select(self, now: float):
+        self.dropStale(now)
+        chosen = self.choose(now)
+        changed = chosen is not self.active
+        if changed:
+            if chosen is not None:
+                chosen.activeSince = now
+                print(f"Showing screen channel {chosen}")
+            self.active = chosen
+
+        controls = []
+        for channel in self.channels.values():
+            if channel is chosen:
+                if channel.paused:
+                    channel.paused = False
+                    controls.append({"type": "resume", "channel": channel.name})
+            elif not channel.paused or channel.lastMessageTime > channel.pauseSentTime + 1.0:
+                # Repeated while a paused producer keeps drawing, in case it
+                #  was not listening yet
+                channel.paused = True
+                channel.pauseSentTime = now
+                controls.append({"type": "pause", "channel": channel.name})
+        return changed, controls
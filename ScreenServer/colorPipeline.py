@@ -0,0 +1,57 @@
+#
+# Server side color correction for the panel
+#  Per channel gamma, white balance and brightness folded into three 256
+#  entry lookup tables, applied to a whole RGB888 frame in one NumPy take()
+#
+#  Config file (JSON), every key optional:
+#    {"gamma": 2.2 or [r, g, b], "whiteBalance": [r, g, b], "brightness": 0.8}
+#
+
+import json
+import numpy
+
+CHANNEL_OFFSETS = numpy.array([0, 256, 512], dtype=numpy.uint16)
+
+
+def perChannel(value) -> list:
+    if isinstance(value, (int, float)):
+        return [float(value)] * 3
+    if len(value) != 3:
+        raise ValueError(f"Expected one value or three (r, g, b), got {value}")
+    return [float(channel) for channel in value]
+
+
+# ****************************************************************************
+class ColorCorrection:
+    def __init__(self, gamma=1.0, whiteBalance=1.0, brightness=1.0):
+        self.gamma = perChannel(gamma)
+        self.whiteBalance = perChannel(whiteBalance)
+        self.brightness = float(brightness)
+        self.table = self.buildTable()
+        self.isIdentity = bool((self.table == numpy.tile(numpy.arange(256), 3)).all())
+
+    @classmethod
+    def fromFile(cls, path: str):
+        with open(path) as f:
+            dat = json.load(f)
+        return cls(dat.get("gamma", 1.0), dat.get("whiteBalance", 1.0), dat.get("brightness", 1.0))
+
+    # The three channel tables back to back, so a channel's value v maps
+    #  through table[channel * 256 + v]
+    def buildTable(self):
+        levels = numpy.arange(256) / 255.0
+        tables = []
+        for channel in range(3):
+            scale = 255.0 * self.brightness * self.whiteBalance[channel]
+            out = numpy.rint(scale * levels ** self.gamma[channel])
+            tables.append(numpy.clip(out, 0, 255))
+        return numpy.concatenate(tables).astype(numpy.uint8)
+
+    def apply(self, frame) -> bytes:
+        if self.isIdentity:
+            return frame
+        pixels = numpy.frombuffer(frame, dtype=numpy.uint8).reshape(-1, 3)
+        return self.table.take(pixels + CHANNEL_OFFSETS).tobytes()
+
+    def __str__(self):
+        return f"gamma={self.gamma} whiteBalance={self.whiteBalance} brightness={self.brightness}"
@@ -0,0 +1,49 @@
+#
+# Bounded LRU cache of frames keyed by content hash, stored as packFrame() packs
+#  Lets producers of repetitive content send a tiny "show <hash>" message
+#  instead of the whole frame once the server has seen it
+#
+
+import threading
+from collections import OrderedDict
+
+
+class FrameCache:
+    def __init__(self, maxBytes: int):
+        self.maxBytes = maxBytes
+        self.totalBytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # Returns (width, height, packed frame) or None
+    def get(self, key: bytes):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: bytes, width: int, height: int, packed: bytes) -> None:
+        if len(packed) > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+
+            self.entries[key] = (width, height, packed)
+            self.totalBytes += len(packed)
+            while self.totalBytes > self.maxBytes:
+                oldKey, (oldWidth, oldHeight, oldPacked) = self.entries.popitem(last=False)
+                self.totalBytes -= len(oldPacked)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
@@ -0,0 +1,99 @@
+#
+# Drift free pacing for producer main loops
+#  Instead of work then sleep(delay), which makes every period delay plus
+#  the work, wait() sleeps until an absolute deadline on the monotonic clock
+#  that advances by one interval per frame. The work is absorbed into the
+#  period as long as it fits.
+#
+#  A frame that misses its deadline is an overrun. By default the loop then
+#  carries on right away and later deadlines count from there. With
+#  skipFrames the pacer instead keeps the original deadlines, skips the ones
+#  already missed and reports how many, so a producer animating with time
+#  can move on by that many steps.
+#
+#  e.g.
+#    pacer = framePacer.FramePacer("life")
+#    while True:
+#        ...draw and send a frame...
+#        pacer.wait(client.rate.interval())
+#
+
+import time
+
+from frameStats import RollingStat
+
+
+class FramePacer:
+    def __init__(self, name: str, skipFrames=False, reportInterval=60.0, window=1000):
+        self.name = name
+        self.skipFrames = skipFrames
+        self.reportInterval = reportInterval
+        self.jitter = RollingStat(window)   # seconds woken up after the deadline
+        self.work = RollingStat(window)     # seconds between waking up and the next wait
+        self.frames = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.interval = 0.0
+        self.reset()
+
+    # Starts the deadlines over from now, e.g. after the loop was paused
+    def reset(self) -> None:
+        now = time.monotonic()
+        self.deadline = now
+        self.lastWake = now
+        self.reportStart = now
+        self.reportFrames = 0
+        self.reportOverruns = 0
+
+    # Sleeps until interval after the previous deadline. Returns the number of
+    #  frames skipped to catch up, which is always 0 without skipFrames
+    def wait(self, interval: float) -> int:
+        now = time.monotonic()
+        self.work.add(now - self.lastWake)
+        self.interval = interval
+        self.deadline += interval
+
+        skipped = 0
+        if now > self.deadline:
+            self.overruns += 1
+            self.reportOverruns += 1
+            if self.skipFrames and interval > 0:
+                skipped = int((now - self.deadline) // interval) + 1
+                self.deadline += skipped * interval
+                self.skipped += skipped
+            else:
+                self.deadline = now
+
+        if self.deadline > now:
+            time.sleep(self.deadline - now)
+
+        wake = time.monotonic()
+        self.jitter.add(wake - self.deadline)
+        self.lastWake = wake
+        self.frames += 1
+        self.reportFrames += 1
+        if self.reportInterval and wake - self.reportStart >= self.reportInterval:
+            self.report(wake)
+        return skipped
+
+    def report(self, now: float) -> None:
+        fps = self.reportFrames / (now - self.reportStart)
+        target = 1.0 / self.interval if self.interval > 0 else 0.0
+        jitter = self.jitter.summary()
+        print(f"{self.name}: {fps:.2f} fps (target {target:.2f}), {self.reportOverruns} overruns, "
+              f"{self.skipped} skipped, work {self.work.mean() * 1000:.1f}ms, "
+              f"jitter p50 {jitter.get('p50', 0.0) * 1000:.2f}ms p99 {jitter.get('p99', 0.0) * 1000:.2f}ms")
+        if self.reportOverruns > self.reportFrames // 2:
+            print(f"{self.name} can't keep up with {target:.2f} fps")
+        self.reportStart = now
+        self.reportFrames = 0
+        self.reportOverruns = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "frames": self.frames,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "work": self.work.summary(),
+            "jitter": self.jitter.summary(),
+        }
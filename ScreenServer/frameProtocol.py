@@ -0,0 +1,476 @@
+#
+# Binary frame wire format for the RGB screen server
+#  Fixed little-endian header followed by the message payload
+#  Sent on the same MazeScreen queue as the JSON messages
+#  The header's x, y, width and height give the region of the server's
+#  virtual canvas the message draws to
+#
+#  MSG_FRAME - keyframe: packed RGB888 buffer (row major)
+#  MSG_DELTA - changed runs against the previous frame of the same stream:
+#              repeated (pixel offset, pixel count, count * RGB888)
+#  MSG_CLIP  - animation the server loops on its own: clip header,
+#              frameCount durations (ms), then frameCount RGB888 frames
+#  MSG_CACHED_FRAME - keyframe the server also keeps in its frame cache
+#  MSG_SHOW  - frameHash() of a cached frame to show; the server answers a
+#              miss with a cacheMiss control message
+#  MSG_PACKED_FRAME - keyframe in the smallest of packFrame()'s encodings:
+#              packed header, palette, then the (compressed) pixel data
+#
+
+import struct
+import random
+import time
+import hashlib
+import zlib
+
+MAGIC = b"MZ"
+PROTOCOL_VERSION = 4
+
+MSG_FRAME = 1
+MSG_DELTA = 2
+MSG_CLIP = 3
+MSG_CACHED_FRAME = 4
+MSG_SHOW = 5
+MSG_PACKED_FRAME = 6
+
+# magic, version, message type, x, y, width, height, stream id,
+#  sequence number, producer send time (time.monotonic_ns(), 0 if unknown)
+HEADER = struct.Struct("<2sBBHHHHHIQ")
+HEADER_SIZE = HEADER.size
+
+# pixel offset, pixel count
+RUN = struct.Struct("<IH")
+MAX_RUN = 0xFFFF
+
+# frame count, loop count (0 loops forever)
+CLIP_HEADER = struct.Struct("<HH")
+CLIP_DURATION = struct.Struct("<I")
+
+FRAME_HASH_SIZE = 16
+
+# Pixel formats of a packed frame: RGB888, or indices into its palette
+PIXELS_RGB = 0
+PIXELS_PALETTE8 = 1
+PIXELS_PALETTE4 = 2     # two pixels per byte, first one in the high nibble
+
+# Compressions of a packed frame's pixel data. RLE is repeated
+#  (run length - 1, pixel) and only used on whole byte pixels
+COMPRESS_NONE = 0
+COMPRESS_RLE = 1
+COMPRESS_ZLIB = 2
+
+# pixel format, compression, palette size (colors)
+PACKED_HEADER = struct.Struct("<BBH")
+MAX_PALETTE = 256
+MAX_RLE_RUN = 256
+
+HIGH_NIBBLES = bytes(value >> 4 for value in range(256))
+LOW_NIBBLES = bytes(value & 0x0F for value in range(256))
+
+SEQ_MASK = 0xFFFFFFFF
+
+# Fanout exchange the server uses to talk back to producers (resync, ...)
+CONTROL_EXCHANGE = "MazeScreenControl"
+
+# AMQP message headers naming the screen channel a producer draws on and its
+#  priority. Messages without them go to DEFAULT_CHANNEL at priority 0
+CHANNEL_HEADER = "channel"
+PRIORITY_HEADER = "priority"
+DEFAULT_CHANNEL = "default"
+
+# Broker side lifetime of a frame message: a frame still queued after this
+#  is stale, better dropped than shown late
+FRAME_EXPIRATION_MS = 2000
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+# ****************************************************************************
+class FrameHeader:
+    def __init__(self, msgType, width, height, streamId=0, seq=0, sendTimeNs=0, x=0, y=0):
+        self.msgType = msgType
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.streamId = streamId
+        self.seq = seq
+        self.sendTimeNs = sendTimeNs
+
+    def __str__(self):
+        return f"type={self.msgType} {self.width}x{self.height}+{self.x}+{self.y} stream={self.streamId} seq={self.seq}"
+
+
+# ****************************************************************************
+def channelHeaders(name: str, priority=0) -> dict:
+    return {CHANNEL_HEADER: name, PRIORITY_HEADER: priority}
+
+
+# True for a pause / resume control message addressed to the named channel
+def isChannelControl(dat: dict, name: str) -> bool:
+    return dat.get("type") in ("pause", "resume") and dat.get("channel") == name
+
+
+def isBinaryMessage(body) -> bool:
+    return body[:2] == MAGIC
+
+
+def nextSeq(seq: int) -> int:
+    return (seq + 1) & SEQ_MASK
+
+
+# True if seq comes after other, allowing for wrap around
+def isNewerSeq(seq: int, other: int) -> bool:
+    return seq != other and ((seq - other) & SEQ_MASK) < 0x80000000
+
+
+# Frames are stamped when encoded, just before they are published
+def packHeader(msgType, width, height, streamId=0, seq=0, x=0, y=0) -> bytes:
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, msgType, x, y, width, height, streamId, seq, time.monotonic_ns())
+
+
+def encodeFrame(width: int, height: int, rgb, streamId=0, seq=0, x=0, y=0) -> bytes:
+    if len(rgb) != width * height * 3:
+        raise ProtocolError(f"Frame is {len(rgb)} bytes, expected {width * height * 3}")
+    return packHeader(MSG_FRAME, width, height, streamId, seq, x, y) + bytes(rgb)
+
+
+def frameHash(width: int, height: int, rgb) -> bytes:
+    digest = hashlib.blake2b(struct.pack("<HH", width, height), digest_size=FRAME_HASH_SIZE)
+    digest.update(rgb)
+    return digest.digest()
+
+
+def encodeCachedFrame(width: int, height: int, rgb, streamId=0, seq=0, x=0, y=0) -> bytes:
+    if len(rgb) != width * height * 3:
+        raise ProtocolError(f"Frame is {len(rgb)} bytes, expected {width * height * 3}")
+    return packHeader(MSG_CACHED_FRAME, width, height, streamId, seq, x, y) + bytes(rgb)
+
+
+def encodeShow(width: int, height: int, key: bytes, streamId=0, seq=0, x=0, y=0) -> bytes:
+    return packHeader(MSG_SHOW, width, height, streamId, seq, x, y) + key
+
+
+def decodeShow(header: FrameHeader, body) -> bytes:
+    key = bytes(memoryview(body)[HEADER_SIZE:])
+    if len(key) != FRAME_HASH_SIZE:
+        raise ProtocolError(f"Frame hash is {len(key)} bytes in {header}")
+    return key
+
+
+# ****************************************************************************
+# Returns (palette bytes, one index byte per pixel), or None past MAX_PALETTE colors
+def buildPalette(rgb):
+    colors = {}
+    indices = bytearray(len(rgb) // 3)
+    for pixel in range(len(indices)):
+        color = rgb[pixel * 3:pixel * 3 + 3]
+        index = colors.get(color)
+        if index is None:
+            if len(colors) == MAX_PALETTE:
+                return None
+            index = colors[color] = len(colors)
+        indices[pixel] = index
+    return b"".join(colors), bytes(indices)
+
+
+def packNibbles(indices: bytes) -> bytes:
+    if len(indices) % 2:
+        indices += b"\0"
+    return bytes((high << 4) | low for high, low in zip(indices[0::2], indices[1::2]))
+
+
+def unpackNibbles(data, count: int) -> bytes:
+    data = bytes(data)
+    indices = bytearray(len(data) * 2)
+    indices[0::2] = data.translate(HIGH_NIBBLES)
+    indices[1::2] = data.translate(LOW_NIBBLES)
+    return bytes(indices[:count])
+
+
+def rleEncode(data: bytes, unit: int) -> bytes:
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        value = data[pos:pos + unit]
+        runEnd = pos + unit
+        while runEnd < len(data) and runEnd - pos < MAX_RLE_RUN * unit and data[runEnd:runEnd + unit] == value:
+            runEnd += unit
+        out.append((runEnd - pos) // unit - 1)
+        out += value
+        pos = runEnd
+    return bytes(out)
+
+
+def rleDecode(data, unit: int, count: int) -> bytes:
+    data = bytes(data)
+    step = unit + 1
+    if len(data) % step:
+        raise ProtocolError(f"RLE data of {len(data)} bytes is not whole runs of {unit} byte pixels")
+    out = bytearray()
+    for pos in range(0, len(data), step):
+        out += data[pos + 1:pos + step] * (data[pos] + 1)
+        if len(out) > count * unit:
+            raise ProtocolError(f"RLE data decodes to more than {count} pixels")
+    return bytes(out)
+
+
+# Tries every pixel format / compression that fits the frame and returns the
+#  smallest packed form: packed header, palette, pixel data
+def packFrame(width: int, height: int, rgb) -> bytes:
+    rgb = bytes(rgb)
+    if len(rgb) != width * height * 3:
+        raise ProtocolError(f"Frame is {len(rgb)} bytes, expected {width * height * 3}")
+
+    candidates = [(PIXELS_RGB, b"", rgb)]
+    paletted = buildPalette(rgb)
+    if paletted is not None:
+        palette, indices = paletted
+        if len(palette) // 3 <= 16:
+            candidates.append((PIXELS_PALETTE4, palette, packNibbles(indices)))
+        candidates.append((PIXELS_PALETTE8, palette, indices))
+
+    best = None
+    for pixelFormat, palette, data in candidates:
+        encodings = [(COMPRESS_NONE, data), (COMPRESS_ZLIB, zlib.compress(data))]
+        if pixelFormat != PIXELS_PALETTE4:
+            encodings.append((COMPRESS_RLE, rleEncode(data, 3 if pixelFormat == PIXELS_RGB else 1)))
+        for compression, payload in encodings:
+            size = PACKED_HEADER.size + len(palette) + len(payload)
+            if best is None or size < best[0]:
+                best = (size, pixelFormat, compression, palette, payload)
+
+    size, pixelFormat, compression, palette, payload = best
+    return PACKED_HEADER.pack(pixelFormat, compression, len(palette) // 3) + palette + payload
+
+
+# Returns the packed RGB888 frame
+def unpackFrame(width: int, height: int, packed):
+    view = memoryview(packed)
+    if len(view) < PACKED_HEADER.size:
+        raise ProtocolError(f"Packed frame of {len(view)} bytes is too short")
+    pixelFormat, compression, paletteSize = PACKED_HEADER.unpack_from(view)
+    pos = PACKED_HEADER.size + paletteSize * 3
+    palette = bytes(view[PACKED_HEADER.size:pos])
+    if len(palette) != paletteSize * 3 or paletteSize > MAX_PALETTE:
+        raise ProtocolError(f"Bad palette of {paletteSize} colors")
+
+    pixelCount = width * height
+    if pixelFormat == PIXELS_RGB:
+        unit, dataSize = 3, pixelCount * 3
+    elif pixelFormat == PIXELS_PALETTE8:
+        unit, dataSize = 1, pixelCount
+    elif pixelFormat == PIXELS_PALETTE4:
+        unit, dataSize = None, (pixelCount + 1) // 2
+    else:
+        raise ProtocolError(f"Unknown packed pixel format {pixelFormat}")
+
+    data = view[pos:]
+    if compression == COMPRESS_ZLIB:
+        # Never inflate past the frame size, whatever the sender claims
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(data, dataSize + 1)
+        except zlib.error as e:
+            raise ProtocolError(f"Bad zlib pixel data: {e}")
+    elif compression == COMPRESS_RLE and unit is not None:
+        data = rleDecode(data, unit, pixelCount)
+    elif compression != COMPRESS_NONE:
+        raise ProtocolError(f"Unsupported compression {compression} for pixel format {pixelFormat}")
+    if len(data) != dataSize:
+        raise ProtocolError(f"Packed pixel data is {len(data)} bytes, expected {dataSize}")
+
+    if pixelFormat == PIXELS_RGB:
+        return data
+    indices = bytes(data) if pixelFormat == PIXELS_PALETTE8 else unpackNibbles(data, pixelCount)
+
+    # One translate() per channel maps every index at C speed
+    rgb = bytearray(pixelCount * 3)
+    for channel in range(3):
+        table = palette[channel::3].ljust(256, b"\0")
+        rgb[channel::3] = indices.translate(table)
+    return rgb
+
+
+# Falls back to a plain MSG_FRAME when packing does not pay
+def encodePackedFrame(width: int, height: int, rgb, streamId=0, seq=0, x=0, y=0) -> bytes:
+    packed = packFrame(width, height, rgb)
+    if len(packed) >= width * height * 3:
+        return encodeFrame(width, height, rgb, streamId, seq, x, y)
+    return packHeader(MSG_PACKED_FRAME, width, height, streamId, seq, x, y) + packed
+
+
+def decodePackedFrame(header: FrameHeader, body):
+    return unpackFrame(header.width, header.height, memoryview(body)[HEADER_SIZE:])
+
+
+# runs is a list of (pixel offset, pixel count) into rgb
+def encodeDelta(width: int, height: int, rgb, runs, streamId: int, seq: int, x=0, y=0) -> bytes:
+    parts = [packHeader(MSG_DELTA, width, height, streamId, seq, x, y)]
+    for offset, count in runs:
+        parts.append(RUN.pack(offset, count))
+        parts.append(bytes(rgb[offset * 3:(offset + count) * 3]))
+    return b"".join(parts)
+
+
+def decodeHeader(body) -> FrameHeader:
+    if len(body) < HEADER_SIZE:
+        raise ProtocolError(f"Short message: {len(body)} bytes")
+    magic, version, msgType, x, y, width, height, streamId, seq, sendTimeNs = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad magic: {magic}")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    return FrameHeader(msgType, width, height, streamId, seq, sendTimeNs, x, y)
+
+
+# Returns the rgb memoryview of a MSG_FRAME without copying the pixel data
+def decodeFramePayload(header: FrameHeader, body):
+    rgb = memoryview(body)[HEADER_SIZE:]
+    if len(rgb) != header.width * header.height * 3:
+        raise ProtocolError(f"Frame payload is {len(rgb)} bytes for {header}")
+    return rgb
+
+
+def decodeFrame(body):
+    header = decodeHeader(body)
+    if header.msgType != MSG_FRAME:
+        raise ProtocolError(f"Not a frame message: {header}")
+    return header, decodeFramePayload(header, body)
+
+
+# durations in seconds, one per frame
+def encodeClip(width: int, height: int, frames: list, durations: list, loopCount=0, streamId=0, seq=0, x=0, y=0) -> bytes:
+    if len(frames) != len(durations) or not frames:
+        raise ProtocolError(f"Clip needs one duration per frame, got {len(frames)} frames and {len(durations)} durations")
+    parts = [packHeader(MSG_CLIP, width, height, streamId, seq, x, y), CLIP_HEADER.pack(len(frames), loopCount)]
+    for duration in durations:
+        parts.append(CLIP_DURATION.pack(int(duration * 1000)))
+    for rgb in frames:
+        if len(rgb) != width * height * 3:
+            raise ProtocolError(f"Clip frame is {len(rgb)} bytes, expected {width * height * 3}")
+        parts.append(bytes(rgb))
+    return b"".join(parts)
+
+
+# Returns (frame memoryviews, durations in seconds, loop count)
+def decodeClip(header: FrameHeader, body):
+    view = memoryview(body)
+    if len(view) < HEADER_SIZE + CLIP_HEADER.size:
+        raise ProtocolError(f"Truncated clip header in {header}")
+    frameCount, loopCount = CLIP_HEADER.unpack_from(view, HEADER_SIZE)
+
+    frameSize = header.width * header.height * 3
+    pos = HEADER_SIZE + CLIP_HEADER.size
+    if len(view) != pos + frameCount * (CLIP_DURATION.size + frameSize) or frameCount == 0:
+        raise ProtocolError(f"Clip of {frameCount} frames is {len(view)} bytes in {header}")
+
+    durations = []
+    for index in range(frameCount):
+        durations.append(CLIP_DURATION.unpack_from(view, pos)[0] / 1000.0)
+        pos += CLIP_DURATION.size
+
+    frames = []
+    for index in range(frameCount):
+        frames.append(view[pos:pos + frameSize])
+        pos += frameSize
+    return frames, durations, loopCount
+
+
+# Yields (pixel offset, pixel count, rgb memoryview) for each run of a MSG_DELTA
+def iterDeltaRuns(header: FrameHeader, body):
+    view = memoryview(body)
+    pixelCount = header.width * header.height
+    pos = HEADER_SIZE
+    while pos < len(view):
+        if pos + RUN.size > len(view):
+            raise ProtocolError(f"Truncated delta run header in {header}")
+        offset, count = RUN.unpack_from(view, pos)
+        pos += RUN.size
+        end = pos + count * 3
+        if offset + count > pixelCount or end > len(view):
+            raise ProtocolError(f"Delta run {offset}+{count} out of range in {header}")
+        yield offset, count, view[pos:end]
+        pos = end
+
+
+# ****************************************************************************
+# Producer side delta encoder
+#  Sends a keyframe every keyframeInterval frames (or when asked to resync),
+#  otherwise only the runs of pixels that changed since the previous frame
+class DeltaEncoder:
+    def __init__(self, width: int, height: int, keyframeInterval=30, streamId=None, x=0, y=0, packKeyframes=False):
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+        self.keyframeInterval = keyframeInterval
+        self.packKeyframes = packKeyframes
+        self.streamId = streamId if streamId is not None else random.randrange(1, 0x10000)
+        self.seq = 0
+        self.framesSinceKeyframe = 0
+        self.lastFrame = None
+
+        # Runs may swallow a short stretch of unchanged pixels when that is
+        #  cheaper than starting a new run header
+        self.maxGap = RUN.size // 3
+
+    def requestKeyframe(self) -> None:
+        self.lastFrame = None
+
+    def handleControl(self, dat: dict) -> None:
+        if dat.get("type") == "resync" and dat.get("streamId") == self.streamId:
+            self.requestKeyframe()
+
+    def findRuns(self, rgb) -> list:
+        last = self.lastFrame
+        return self.mergeRuns(pixel for pixel in range(self.width * self.height)
+                              if rgb[pixel * 3:pixel * 3 + 3] != last[pixel * 3:pixel * 3 + 3])
+
+    # (offset, count) runs covering the given changed pixels, in order
+    def mergeRuns(self, pixels) -> list:
+        runs = []
+        runStart = None
+        runEnd = None
+        for pixel in pixels:
+            if runStart is not None and pixel - runEnd <= self.maxGap and pixel - runStart < MAX_RUN:
+                runEnd = pixel + 1
+                continue
+            if runStart is not None:
+                runs.append((runStart, runEnd - runStart))
+            runStart = pixel
+            runEnd = pixel + 1
+        if runStart is not None:
+            runs.append((runStart, runEnd - runStart))
+        return runs
+
+    # changed optionally lists the pixels (row major offsets) that can differ
+    #  from the previous frame, e.g. from a Life engine's change list, which
+    #  saves comparing the whole frame
+    def encode(self, rgb, forceKeyframe=False, changed=None) -> bytes:
+        rgb = bytes(rgb)
+        self.seq = nextSeq(self.seq)
+
+        if forceKeyframe or self.lastFrame is None or self.framesSinceKeyframe >= self.keyframeInterval:
+            return self.encodeKeyframe(rgb)
+
+        if changed is not None:
+            runs = self.mergeRuns(sorted(set(changed)))
+        else:
+            runs = self.findRuns(rgb)
+        deltaSize = sum(RUN.size + count * 3 for offset, count in runs)
+        if deltaSize >= len(rgb):
+            return self.encodeKeyframe(rgb)
+
+        self.lastFrame = rgb
+        self.framesSinceKeyframe += 1
+        return encodeDelta(self.width, self.height, rgb, runs, self.streamId, self.seq, self.x, self.y)
+
+    def encodeKeyframe(self, rgb: bytes) -> bytes:
+        self.lastFrame = rgb
+        self.framesSinceKeyframe = 1
+        if self.packKeyframes:
+            return encodePackedFrame(self.width, self.height, rgb, self.streamId, self.seq, self.x, self.y)
+        return encodeFrame(self.width, self.height, rgb, self.streamId, self.seq, self.x, self.y)
@@ -0,0 +1,123 @@
+#
+# Recording of the message stream the screen server received
+#  Every message body is appended with its receive time and screen channel
+#  to a memory mapped log, so frameReplay.py can push the exact same stream
+#  through the server's decode / draw path again.
+#
+#  Layout: log header, then records of [record header][channel name][body]
+#  The header's committed length only covers finished records, so a log cut
+#  short by a crash still reads back up to its last whole record.
+#
+
+import os
+import mmap
+import time
+import struct
+import threading
+
+LOG_MAGIC = b"MZRC"
+LOG_VERSION = 1
+
+# magic, version, start time (time.time_ns()), committed length
+LOG_HEADER = struct.Struct("<4sH2xQQ")
+COMMITTED_OFFSET = LOG_HEADER.size - 8
+# receive time (ns since the recording started), body length, priority, channel name length
+RECORD_HEADER = struct.Struct("<QIhH")
+
+GROW_BYTES = 16 * 1024 * 1024
+
+
+class LogError(ValueError):
+    pass
+
+
+# ****************************************************************************
+class FrameRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.startNs = time.monotonic_ns()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.size = 0
+        self.map = None
+        self.length = LOG_HEADER.size
+        self.records = 0
+
+        self.grow(GROW_BYTES)
+        LOG_HEADER.pack_into(self.map, 0, LOG_MAGIC, LOG_VERSION, time.time_ns(), self.length)
+
+    # The file grows in large steps so appends are plain memory copies
+    def grow(self, minSize: int) -> None:
+        size = max(minSize, self.size + GROW_BYTES)
+        if self.map is not None:
+            self.map.close()
+        os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.size = size
+
+    def append(self, body, channelName: str, priority: int) -> None:
+        name = channelName.encode("utf-8")
+        priority = max(-0x8000, min(0x7FFF, priority))
+        recvNs = time.monotonic_ns() - self.startNs
+        with self.lock:
+            if self.map is None:
+                return
+            end = self.length + RECORD_HEADER.size + len(name) + len(body)
+            if end > self.size:
+                self.grow(end)
+
+            pos = self.length
+            RECORD_HEADER.pack_into(self.map, pos, recvNs, len(body), priority, len(name))
+            pos += RECORD_HEADER.size
+            self.map[pos:pos + len(name)] = name
+            pos += len(name)
+            self.map[pos:end] = body
+
+            self.length = end
+            self.records += 1
+            struct.pack_into("<Q", self.map, COMMITTED_OFFSET, end)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.map is None:
+                return
+            self.map.flush()
+            self.map.close()
+            self.map = None
+            os.ftruncate(self.fd, self.length)
+            os.close(self.fd)
+        print(f"Recorded {self.records} messages to {self.path}")
+
+
+# ****************************************************************************
+class FrameLog:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < LOG_HEADER.size:
+            raise LogError(f"{path} is too short for a frame log")
+        magic, version, self.startTime, self.length = LOG_HEADER.unpack_from(self.map)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise LogError(f"{path} is not a version {LOG_VERSION} frame log")
+        self.length = min(self.length, len(self.map))
+
+    # Yields (receive time in seconds, channel name, priority, body memoryview)
+    #  The bodies point into the mapping, so drop them before close()
+    def records(self):
+        view = memoryview(self.map)
+        pos = LOG_HEADER.size
+        try:
+            while pos + RECORD_HEADER.size <= self.length:
+                recvNs, bodyLength, priority, nameLength = RECORD_HEADER.unpack_from(view, pos)
+                pos += RECORD_HEADER.size
+                name = str(view[pos:pos + nameLength], "utf-8")
+                pos += nameLength
+                if pos + bodyLength > self.length:
+                    raise LogError(f"Truncated record at offset {pos}")
+                yield recvNs / 1e9, name, priority, view[pos:pos + bodyLength]
+                pos += bodyLength
+        finally:
+            view.release()
+
+    def close(self) -> None:
+        self.map.close()
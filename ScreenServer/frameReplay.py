@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Replays a frame log recorded by rgbScreenServer.py --record
+#  Feeds the recorded messages through the screen server's decode and draw
+#  path without the broker: at the recorded pace, N times faster, or as fast
+#  as possible (--speed 0). Prints the server's frame stats at the end.
+#
+#  The render thread only shows the newest frame, so a fast replay mostly
+#  measures decoding. --every-frame draws and swaps each message's frame on
+#  the replay thread instead, to profile the whole path.
+#
+#  e.g. ./frameReplay.py --led-backend emulator --speed 0 capture.mzr
+#       ./frameReplay.py --led-backend emulator --led-emulator-refresh 0 --speed 0 --every-frame capture.mzr
+#
+
+from rgbScreenServer import ScreenServer
+import frameRecorder
+
+import time
+import json
+
+
+class ReplayServer(ScreenServer):
+    def __init__(self, *args, **kwargs):
+        super(ReplayServer, self).__init__(*args, **kwargs)
+        self.parser.add_argument("log", action="store", help="Frame log to replay", type=str)
+        self.parser.add_argument("--speed", action="store", help="Replay speed, 2 for twice as fast, 0 for as fast as possible. Default: 1", default=1.0, type=float)
+        self.parser.add_argument("--loops", action="store", help="Times to replay the log. Default: 1", default=1, type=int)
+        self.parser.add_argument("--every-frame", action="store_true", help="Draw and swap the frame of every message as it is replayed, instead of the newest on the render thread's schedule. Default: off", default=False)
+
+    # The replay thread presents the frames itself
+    def renderLoop(self):
+        if not self.args.every_frame:
+            super(ReplayServer, self).renderLoop()
+
+    # Recorded send stamps are from another run, so queue delay and latency mean nothing
+    def recordDelay(self, name: str, sendTimeNs: int):
+        pass
+
+    def replay(self, log):
+        count = 0
+        startTime = time.monotonic()
+        for loop in range(self.args.loops):
+            loopStart = time.monotonic()
+            for recvTime, channelName, priority, body in log.records():
+                if self.args.speed > 0:
+                    delay = loopStart + recvTime / self.args.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                self.handleBody(body, channelName, priority)
+                if self.args.every_frame:
+                    self.renderPending()
+                count += 1
+                del body
+
+        if not self.args.every_frame:
+            # Let the render thread present the last frame
+            time.sleep(2.0 / self.args.target_fps)
+        return count, time.monotonic() - startTime
+
+    def run(self):
+        self.setupRendering()
+        log = frameRecorder.FrameLog(self.args.log)
+        try:
+            count, elapsed = self.replay(log)
+        finally:
+            self.stopRenderingThreads()
+        log.close()
+
+        print(f"Replayed {count} messages in {elapsed:.3f}s ({count / elapsed:.1f} messages/s)")
+        print(json.dumps(self.stats.snapshot(), indent=2))
+
+
+# Main function
+if __name__ == "__main__":
+    replayServer = ReplayServer()
+    if (not replayServer.process()):
+        replayServer.print_help()
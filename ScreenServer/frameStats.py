@@ -0,0 +1,148 @@
+#
+# Frame pipeline instrumentation for the screen server
+#  Rolling timing samples (queue delay, decode, draw, swap, end to end) and
+#  counters (received, rendered, dropped, sequence gaps, out of order),
+#  published as a periodically rewritten stats file and as plain text on
+#  http://<host>:<port>/metrics
+#
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# ****************************************************************************
+class RollingStat:
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.total = 0
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+        self.total += 1
+
+    def mean(self) -> float:
+        return sum(self.samples) / len(self.samples) if self.samples else 0.0
+
+    def percentile(self, ordered: list, fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"count": self.total}
+        ordered = sorted(self.samples)
+        return {
+            "count": self.total,
+            "mean": sum(ordered) / len(ordered),
+            "p50": self.percentile(ordered, 0.50),
+            "p99": self.percentile(ordered, 0.99),
+            "max": ordered[-1],
+        }
+
+
+# ****************************************************************************
+class FrameStats:
+    TIMINGS = ["queue_delay", "decode", "draw", "swap", "latency"]
+    COUNTERS = ["received", "rendered", "dropped", "sequence_gaps", "out_of_order", "decode_errors", "cache_hits", "cache_misses", "tiles_drawn"]
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.startTime = time.monotonic()
+        self.timings = {name: RollingStat(window) for name in self.TIMINGS}
+        self.counters = {name: 0 for name in self.COUNTERS}
+        self.swapTimes = deque(maxlen=window)
+
+    # seconds
+    def record(self, name: str, value: float) -> None:
+        with self.lock:
+            self.timings[name].add(value)
+
+    def increment(self, name: str, count=1) -> None:
+        with self.lock:
+            self.counters[name] += count
+
+    def recordSwap(self, when: float) -> None:
+        with self.lock:
+            self.swapTimes.append(when)
+            self.counters["rendered"] += 1
+
+    def fps(self) -> float:
+        if len(self.swapTimes) < 2:
+            return 0.0
+        elapsed = self.swapTimes[-1] - self.swapTimes[0]
+        return (len(self.swapTimes) - 1) / elapsed if elapsed > 0 else 0.0
+
+    # Frame rate the pipeline keeps up with, capped at targetFps. Decoding
+    #  runs on the consumer thread, drawing and swapping on the render thread
+    def sustainableFps(self, targetFps: float) -> float:
+        with self.lock:
+            decode = self.timings["decode"].mean()
+            render = self.timings["draw"].mean() + self.timings["swap"].mean()
+        cost = max(decode, render)
+        if cost <= 0:
+            return targetFps
+        return min(targetFps, 1.0 / cost)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "uptime": time.monotonic() - self.startTime,
+                "fps": self.fps(),
+                "counters": dict(self.counters),
+                "timings": {name: stat.summary() for name, stat in self.timings.items()},
+            }
+
+    def formatMetrics(self) -> str:
+        snap = self.snapshot()
+        lines = [
+            f"mazescreen_uptime_seconds {snap['uptime']:.3f}",
+            f"mazescreen_fps {snap['fps']:.3f}",
+        ]
+        for name, value in snap["counters"].items():
+            lines.append(f"mazescreen_frames_{name}_total {value}")
+        for name, summary in snap["timings"].items():
+            lines.append(f"mazescreen_{name}_seconds_count {summary['count']}")
+            for key in ["mean", "p50", "p99", "max"]:
+                if key in summary:
+                    lines.append(f'mazescreen_{name}_seconds{{stat="{key}"}} {summary[key]:.6f}')
+        return "\n".join(lines) + "\n"
+
+    def writeStatsFile(self, path: str) -> None:
+        tmpPath = path + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmpPath, path)
+
+    def writeLoop(self, path: str, interval: float, stopEvent) -> None:
+        while not stopEvent.wait(interval):
+            try:
+                self.writeStatsFile(path)
+            except OSError as e:
+                print(f"Stats file write fail: {e}")
+
+
+# ****************************************************************************
+def startMetricsServer(stats: FrameStats, port: int) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = stats.formatMetrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,281 @@
+#
+# In-process stand-in for the RabbitMQ broker
+#  Implements the part of pika's BlockingConnection / channel interface the
+#  screen server and mazergb use: named queues, the default exchange and
+#  fanout exchanges, basic_qos prefetch with acks, per-message expiration,
+#  add_callback_threadsafe, call_later and process_data_events. Every
+#  connection is driven by the thread that calls its process_data_events or
+#  start_consuming, as with pika.
+#
+#  e.g. the whole pipeline in one process:
+#    broker = localBroker.LocalBroker()
+#    client = mazergb.ScreenClient("life", connectionFactory=broker.connect)
+#
+#  Exclusive queues are not deleted with their connection, and unacked
+#  messages of a closed connection are not requeued.
+#
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pika
+import pika.exceptions
+
+
+class BrokerError(pika.exceptions.AMQPError):
+    pass
+
+
+# ****************************************************************************
+class Message:
+    def __init__(self, body: bytes, properties, routingKey: str, now: float):
+        self.body = body
+        self.properties = properties
+        self.routingKey = routingKey
+        self.expiresAt = None
+        if properties.expiration is not None:
+            self.expiresAt = now + int(properties.expiration) / 1000.0
+
+
+class Queue:
+    def __init__(self, name: str):
+        self.name = name
+        self.messages = deque()
+        self.consumers = []
+
+
+class Consumer:
+    def __init__(self, channel, queue: Queue, callback, autoAck: bool, tag: str):
+        self.channel = channel
+        self.queue = queue
+        self.callback = callback
+        self.autoAck = autoAck
+        self.tag = tag
+
+
+# ****************************************************************************
+class LocalBroker:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queues = {}
+        self.exchanges = {"": None}     # fanout exchange name -> bound queue names
+        self.names = itertools.count(1)
+
+        # Totals for benchmarks, per queue name
+        self.publishedCount = {}
+        self.publishedBytes = {}
+        self.expiredCount = 0
+
+    def connect(self):
+        return LocalConnection(self)
+
+    # Must hold condition
+    def route(self, exchange: str, routingKey: str) -> list:
+        if exchange == "":
+            queue = self.queues.get(routingKey)
+            return [queue] if queue is not None else []
+        bound = self.exchanges.get(exchange)
+        if bound is None:
+            raise BrokerError(f"No exchange '{exchange}'")
+        return [self.queues[name] for name in bound if name in self.queues]
+
+    def publish(self, exchange: str, routingKey: str, body, properties) -> None:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if properties is None:
+            properties = pika.BasicProperties()
+        with self.condition:
+            now = time.monotonic()
+            for queue in self.route(exchange, routingKey):
+                queue.messages.append(Message(body, properties, routingKey, now))
+                self.publishedCount[queue.name] = self.publishedCount.get(queue.name, 0) + 1
+                self.publishedBytes[queue.name] = self.publishedBytes.get(queue.name, 0) + len(body)
+            self.condition.notify_all()
+
+    # Messages waiting in the queue plus the ones delivered but not yet acked
+    def pending(self, queueName: str) -> int:
+        with self.condition:
+            queue = self.queues.get(queueName)
+            if queue is None:
+                return 0
+            unacked = sum(len(consumer.channel.unacked) for consumer in queue.consumers)
+            return len(queue.messages) + unacked
+
+
+# ****************************************************************************
+class LocalConnection:
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+        self.channels = []
+        self.callbacks = deque()
+        self.timers = []
+        self.timerSeq = itertools.count()
+        self.is_open = True
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.is_open
+
+    def channel(self):
+        if not self.is_open:
+            raise BrokerError("Connection is closed")
+        channel = LocalChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback) -> None:
+        with self.broker.condition:
+            if not self.is_open:
+                raise BrokerError("Connection is closed")
+            self.callbacks.append(callback)
+            self.broker.condition.notify_all()
+
+    def call_later(self, delay: float, callback) -> None:
+        with self.broker.condition:
+            heapq.heappush(self.timers, (time.monotonic() + delay, next(self.timerSeq), callback))
+            self.broker.condition.notify_all()
+
+    def close(self) -> None:
+        with self.broker.condition:
+            self.is_open = False
+            for channel in self.channels:
+                channel.cancelConsumers()
+            self.broker.condition.notify_all()
+
+    # Must hold the broker's condition. Returns the work that is due now
+    def collectWork(self, now: float) -> list:
+        work = list(self.callbacks)
+        self.callbacks.clear()
+        while self.timers and self.timers[0][0] <= now:
+            work.append(heapq.heappop(self.timers)[2])
+        for channel in self.channels:
+            work.extend(channel.collectDeliveries(now))
+        return work
+
+    def nextTimer(self):
+        return self.timers[0][0] if self.timers else None
+
+    # Runs whatever is due; without any, waits for some up to time_limit
+    #  seconds (forever when None)
+    def process_data_events(self, time_limit=0) -> None:
+        if not self.is_open:
+            raise BrokerError("Connection is closed")
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        condition = self.broker.condition
+        with condition:
+            while True:
+                now = time.monotonic()
+                work = self.collectWork(now)
+                if work or not self.is_open or (deadline is not None and now >= deadline):
+                    break
+                wakeAt = deadline
+                nextTimer = self.nextTimer()
+                if nextTimer is not None and (wakeAt is None or nextTimer < wakeAt):
+                    wakeAt = nextTimer
+                condition.wait(None if wakeAt is None else max(wakeAt - now, 0))
+
+        for callback in work:
+            callback()
+
+
+# ****************************************************************************
+class LocalChannel:
+    def __init__(self, connection: LocalConnection):
+        self.connection = connection
+        self.broker = connection.broker
+        self.consumers = []
+        self.prefetch = 0
+        self.unacked = {}       # delivery tag -> message
+        self.deliveryTags = itertools.count(1)
+        self.consuming = False
+
+    def queue_declare(self, queue="", passive=False, exclusive=False, **kwargs):
+        broker = self.broker
+        with broker.condition:
+            if not queue:
+                queue = f"local.gen-{next(broker.names)}"
+            existing = broker.queues.get(queue)
+            if existing is None:
+                if passive:
+                    raise BrokerError(f"No queue '{queue}'")
+                existing = broker.queues[queue] = Queue(queue)
+            return SimpleNamespace(method=SimpleNamespace(queue=queue,
+                                                          message_count=len(existing.messages),
+                                                          consumer_count=len(existing.consumers)))
+
+    def exchange_declare(self, exchange: str, exchange_type="fanout", **kwargs) -> None:
+        if exchange_type != "fanout":
+            raise BrokerError(f"Only fanout exchanges are supported, not {exchange_type}")
+        with self.broker.condition:
+            self.broker.exchanges.setdefault(exchange, set())
+
+    def queue_bind(self, queue: str, exchange: str, routing_key=None, **kwargs) -> None:
+        with self.broker.condition:
+            bound = self.broker.exchanges.get(exchange)
+            if bound is None:
+                raise BrokerError(f"No exchange '{exchange}'")
+            bound.add(queue)
+
+    def basic_qos(self, prefetch_count=0, **kwargs) -> None:
+        self.prefetch = prefetch_count
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack=False, **kwargs) -> str:
+        with self.broker.condition:
+            target = self.broker.queues.get(queue)
+            if target is None:
+                raise BrokerError(f"No queue '{queue}'")
+            tag = f"ctag-{next(self.broker.names)}"
+            consumer = Consumer(self, target, on_message_callback, auto_ack, tag)
+            target.consumers.append(consumer)
+            self.consumers.append(consumer)
+            self.broker.condition.notify_all()
+            return tag
+
+    def basic_ack(self, delivery_tag=0, **kwargs) -> None:
+        with self.broker.condition:
+            self.unacked.pop(delivery_tag, None)
+            self.broker.condition.notify_all()
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None, **kwargs) -> None:
+        if not self.connection.is_open:
+            raise BrokerError("Connection is closed")
+        self.broker.publish(exchange, routing_key, body, properties)
+
+    def start_consuming(self) -> None:
+        self.consuming = True
+        while self.consuming and self.connection.is_open:
+            self.connection.process_data_events(time_limit=1.0)
+
+    def stop_consuming(self) -> None:
+        self.consuming = False
+
+    # Must hold the broker's condition
+    def cancelConsumers(self) -> None:
+        for consumer in self.consumers:
+            consumer.queue.consumers.remove(consumer)
+        self.consumers.clear()
+
+    # Must hold the broker's condition. Takes the messages this channel's
+    #  consumers may have now and returns their callbacks
+    def collectDeliveries(self, now: float) -> list:
+        deliveries = []
+        for consumer in self.consumers:
+            messages = consumer.queue.messages
+            while messages:
+                if not consumer.autoAck and self.prefetch and len(self.unacked) >= self.prefetch:
+                    break
+                message = messages.popleft()
+                if message.expiresAt is not None and now >= message.expiresAt:
+                    self.broker.expiredCount += 1
+                    continue
+                tag = next(self.deliveryTags)
+                if not consumer.autoAck:
+                    self.unacked[tag] = message
+                method = SimpleNamespace(delivery_tag=tag, routing_key=message.routingKey, consumer_tag=consumer.tag)
+                deliveries.append(lambda consumer=consumer, method=method, message=message:
+                                  consumer.callback(self, method, message.properties, message.body))
+        return deliveries
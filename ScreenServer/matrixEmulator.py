@@ -0,0 +1,119 @@
+#
+# In-process stand-in for the rgbmatrix driver
+#  Mirrors the parts of RGBMatrix / FrameCanvas the screen server uses over
+#  NumPy pixel buffers, with SwapOnVSync paced to a simulated refresh rate.
+#  Selected with --led-backend emulator so the server runs off the Pi.
+#
+
+import time
+import numpy
+
+
+# ****************************************************************************
+class EmulatedRGBMatrixOptions:
+    def __init__(self):
+        self.hardware_mapping = "regular"
+        self.rows = 32
+        self.cols = 32
+        self.chain_length = 1
+        self.parallel = 1
+        self.row_address_type = 0
+        self.multiplexing = 0
+        self.pwm_bits = 11
+        self.brightness = 100
+        self.pwm_lsb_nanoseconds = 130
+        self.led_rgb_sequence = "RGB"
+        self.pixel_mapper_config = ""
+        self.panel_type = ""
+        self.show_refresh_rate = 0
+        self.gpio_slowdown = 1
+        self.disable_hardware_pulsing = False
+        self.drop_privileges = True
+
+
+# ****************************************************************************
+class EmulatedCanvas:
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.pixels = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+
+    def SetPixel(self, x, y, r, g, b):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y, x] = (r, g, b)
+
+    def Clear(self):
+        self.pixels[:] = 0
+
+    def Fill(self, r, g, b):
+        self.pixels[:] = (r, g, b)
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        if image.mode != "RGB":
+            raise Exception("Currently, only RGB mode is supported for SetImage().")
+
+        src = numpy.asarray(image)
+        x0 = max(offset_x, 0)
+        y0 = max(offset_y, 0)
+        x1 = min(offset_x + src.shape[1], self.width)
+        y1 = min(offset_y + src.shape[0], self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        self.pixels[y0:y1, x0:x1] = src[y0 - offset_y:y1 - offset_y, x0 - offset_x:x1 - offset_x]
+
+    def tobytes(self) -> bytes:
+        return self.pixels.tobytes()
+
+
+# ****************************************************************************
+class EmulatedRGBMatrix:
+    def __init__(self, options=None, refreshRate=120.0):
+        if options is None:
+            options = EmulatedRGBMatrixOptions()
+        self.options = options
+
+        self.width = options.cols * options.chain_length
+        self.height = options.rows * options.parallel
+        if "Rotate:90" in options.pixel_mapper_config or "Rotate:270" in options.pixel_mapper_config:
+            self.width, self.height = self.height, self.width
+        self.brightness = options.brightness
+
+        self.vsyncPeriod = 1.0 / refreshRate if refreshRate > 0 else 0.0
+        self.nextVSync = time.monotonic()
+        self.swapCount = 0
+
+        # Like the real driver, the matrix itself draws onto the canvas on screen
+        self.frontCanvas = EmulatedCanvas(self.width, self.height)
+
+    def CreateFrameCanvas(self):
+        return EmulatedCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction=1):
+        if self.vsyncPeriod > 0:
+            now = time.monotonic()
+            if self.nextVSync > now:
+                time.sleep(self.nextVSync - now)
+            else:
+                self.nextVSync = now
+            self.nextVSync += self.vsyncPeriod * framerate_fraction
+
+        previous = self.frontCanvas
+        self.frontCanvas = canvas
+        self.swapCount += 1
+        return previous
+
+    def SetPixel(self, x, y, r, g, b):
+        self.frontCanvas.SetPixel(x, y, r, g, b)
+
+    def Clear(self):
+        self.frontCanvas.Clear()
+
+    def Fill(self, r, g, b):
+        self.frontCanvas.Fill(r, g, b)
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        self.frontCanvas.SetImage(image, offset_x, offset_y, unsafe)
+
+    # Packed RGB888 copy of what is on screen, for byte-for-byte comparisons
+    def tobytes(self) -> bytes:
+        return self.frontCanvas.tobytes()
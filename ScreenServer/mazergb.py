@@ -0,0 +1,278 @@
+#
+# Client library for screen server producers
+#  A ScreenClient owns one long lived broker connection on a background
+#  thread. Producers hand it finished messages, which wait in a small bounded
+#  outbox (the oldest is dropped when it is full) until that thread publishes
+#  them, so a producer's tick loop never blocks on the broker. The thread
+#  reconnects with backoff and applies the server's control messages:
+#  pause / resume, status (rate control), resync and cache misses.
+#
+#  Producers import it like the other screen server modules:
+#    sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/../ScreenServer'))
+#    import mazergb
+#
+
+import json
+import random
+import threading
+from collections import deque
+
+import pika
+
+import frameProtocol
+import shmTransport
+import rateControl
+import screenFrame
+
+QUEUE_NAME = "MazeScreen"
+
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+
+# ****************************************************************************
+class ScreenClient:
+    def __init__(self, channelName: str, priority=0, fps=10.0, host="localhost", outboxSize=8, useShm=True, connectionFactory=None):
+        self.host = host
+        # Called for every (re)connect instead of opening a pika connection,
+        #  e.g. localBroker.LocalBroker().connect
+        self.connectionFactory = connectionFactory
+
+        self.producerChannel = channelName
+        self.priority = priority
+        self.shm = shmTransport.openWriter() if useShm else None
+        if self.shm:
+            # The server draws everything from the ring on its own channel, so
+            #  what still goes through the broker (clears, batches, clips) goes
+            #  to that channel too
+            self.setChannel(shmTransport.CHANNEL)
+            print(f"Sending frames through {self.shm.path}")
+        else:
+            self.setChannel(channelName)
+        self.rate = rateControl.RateController(fps)
+        self.paused = False
+        self.controlHandlers = []   # called with every control message, on the client thread
+
+        # Frame state, shared with cache miss handling on the client thread
+        self.sendLock = threading.RLock()
+        self.streamId = random.randrange(1, 0x10000)
+        self.seq = 0
+        self.encoder = None
+        self.serverFrames = set()   # hashes the server should have cached
+        self.lastCachedFrame = None
+
+        self.lock = threading.Lock()
+        self.outbox = deque(maxlen=outboxSize)
+        self.dropped = 0
+        self.connection = None
+        self.channel = None
+        self.stopEvent = threading.Event()
+
+        self.thread = threading.Thread(target=self.run, name="mazergb", daemon=True)
+        self.thread.start()
+
+    def setChannel(self, channelName: str) -> None:
+        self.channelName = channelName
+        # Frames go stale in the queue, one-off messages like clips must not
+        self.frameProperties = pika.BasicProperties(headers=frameProtocol.channelHeaders(channelName, self.priority),
+                                                    expiration=str(frameProtocol.FRAME_EXPIRATION_MS))
+        self.properties = pika.BasicProperties(headers=frameProtocol.channelHeaders(channelName, self.priority))
+
+    # ************************************************************************
+    # Client thread: the only one that touches the pika connection
+    def connect(self) -> None:
+        if self.connectionFactory is not None:
+            connection = self.connectionFactory()
+        else:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        channel = connection.channel()
+        channel.queue_declare(queue=QUEUE_NAME)
+
+        # Private queue on the server's fanout exchange for its control messages
+        channel.exchange_declare(exchange=frameProtocol.CONTROL_EXCHANGE, exchange_type="fanout")
+        result = channel.queue_declare(queue="", exclusive=True)
+        channel.queue_bind(exchange=frameProtocol.CONTROL_EXCHANGE, queue=result.method.queue)
+        channel.basic_consume(queue=result.method.queue, on_message_callback=self.controlHandler, auto_ack=True)
+
+        with self.lock:
+            self.connection = connection
+            self.channel = channel
+        print(f"Connected to the screen server broker on {self.host}")
+
+    def run(self) -> None:
+        backoff = MIN_BACKOFF
+        while True:
+            try:
+                self.connect()
+                backoff = MIN_BACKOFF
+                while not self.stopEvent.is_set():
+                    self.drainOutbox()
+                    self.connection.process_data_events(time_limit=0.1)
+                self.drainOutbox()
+                self.connection.close()
+                return
+            except pika.exceptions.AMQPError as e:
+                with self.lock:
+                    self.connection = None
+                    self.channel = None
+                if self.stopEvent.is_set():
+                    print(f"Screen server broker unreachable, {len(self.outbox)} messages not sent")
+                    return
+                print(f"Screen server broker connection lost ({e!r}), retrying in {backoff:.1f}s")
+                self.stopEvent.wait(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def drainOutbox(self) -> None:
+        while True:
+            with self.lock:
+                if not self.outbox or self.channel is None:
+                    return
+                body, properties = self.outbox.popleft()
+                channel = self.channel
+            try:
+                channel.basic_publish(exchange="", routing_key=QUEUE_NAME, body=body, properties=properties)
+            except pika.exceptions.AMQPError:
+                with self.lock:
+                    self.outbox.appendleft((body, properties))
+                raise
+
+    def controlHandler(self, ch, method, properties, body) -> None:
+        try:
+            dat = json.loads(body)
+        except ValueError:
+            print(f"Bad control message: {body}")
+            return
+
+        msgType = dat.get("type")
+        if frameProtocol.isChannelControl(dat, self.channelName):
+            self.paused = msgType == "pause"
+            print(f"Screen channel {self.channelName} {msgType}d")
+        elif msgType == "status":
+            self.rate.handleControl(dat)
+        elif msgType == "resync":
+            # Not between the producer's keyframe check and its frame compare
+            with self.sendLock:
+                if self.encoder is not None:
+                    self.encoder.handleControl(dat)
+        elif msgType == "cacheMiss" and dat.get("streamId") == self.streamId:
+            self.handleCacheMiss(bytes.fromhex(dat["hash"]))
+
+        for handler in self.controlHandlers:
+            handler(dat)
+
+    def handleCacheMiss(self, key: bytes) -> None:
+        with self.sendLock:
+            self.serverFrames.discard(key)
+            if self.lastCachedFrame is not None and self.lastCachedFrame[3] == key:
+                # The server evicted what should be on screen, upload it again
+                width, height, rgb, key = self.lastCachedFrame
+                self.sendCachedFrame(width, height, rgb)
+
+    # ************************************************************************
+    # Producer side, never blocks on the broker
+    def publish(self, body, properties=None) -> None:
+        with self.lock:
+            if len(self.outbox) == self.outbox.maxlen:
+                self.dropped += 1
+            self.outbox.append((body, properties or self.frameProperties))
+            connection = self.connection
+        if connection is not None:
+            try:
+                connection.add_callback_threadsafe(self.drainOutbox)
+            except pika.exceptions.AMQPError:
+                pass    # Lost, the client thread reconnects and drains the outbox
+
+    # True while this client holds a ring the server reads. Must hold
+    #  sendLock. Once the server stops reading it, frames go back to the
+    #  broker on the producer's own channel
+    def useRing(self) -> bool:
+        if self.shm and not self.shm.isAlive():
+            print(f"{self.shm.path} is no longer read, sending frames through the broker")
+            self.shm.close()
+            self.shm = None
+            self.encoder = None     # Its keyframes were not packed for the wire
+            self.setChannel(self.producerChannel)
+        return self.shm is not None
+
+    # Frames go through shared memory when this client holds the ring
+    def publishFrame(self, body) -> None:
+        if self.useRing():
+            self.shm.publish(body)
+        else:
+            self.publish(body)
+
+    def nextSeq(self) -> int:
+        self.seq = frameProtocol.nextSeq(self.seq)
+        return self.seq
+
+    def sendJson(self, dat: dict) -> None:
+        self.publish(json.dumps(dat))
+
+    def sendClear(self) -> None:
+        self.sendJson({"type": "clear"})
+
+    # The server draws the ops offscreen and shows them all at once
+    def sendBatch(self, ops: list) -> None:
+        self.sendJson({"type": "batch", "ops": ops + [{"type": "flush"}]})
+
+    # Per pixel JSON redraw of a PIL image, for servers without the binary protocol
+    def sendRedraw(self, image) -> None:
+        frame = screenFrame.Frame.fromImage(image)
+        self.sendJson({"type": "redraw", "pixels": frame.redrawPixels()})
+
+    def sendImage(self, image, x=0, y=0) -> None:
+        self.sendScreenFrame(screenFrame.Frame.fromImage(image), x, y)
+
+    def sendScreenFrame(self, frame: screenFrame.Frame, x=0, y=0) -> None:
+        self.sendFrame(frame.width, frame.height, frame.tobytes(), x, y)
+
+    def sendFrame(self, width: int, height: int, rgb, x=0, y=0) -> None:
+        with self.sendLock:
+            seq = self.nextSeq()
+            if self.useRing():
+                self.shm.publish(frameProtocol.encodeFrame(width, height, rgb, self.streamId, seq, x, y))
+            else:
+                # Packing only pays off on the wire
+                self.publish(frameProtocol.encodePackedFrame(width, height, rgb, self.streamId, seq, x, y))
+
+    # changed: pixels that can differ from the previous frame, see DeltaEncoder.encode
+    def sendDelta(self, width: int, height: int, rgb, x=0, y=0, changed=None) -> None:
+        with self.sendLock:
+            useRing = self.useRing()
+            if self.encoder is None:
+                self.encoder = frameProtocol.DeltaEncoder(width, height, x=x, y=y, packKeyframes=not useRing)
+            if useRing:
+                # The server only reads the newest slot of the ring, so send whole frames
+                self.shm.publish(self.encoder.encode(rgb, forceKeyframe=True))
+            else:
+                self.publish(self.encoder.encode(rgb, changed=changed))
+
+    # Repeated frames go out as a 16 byte hash once the server has them cached
+    def sendCachedFrame(self, width: int, height: int, rgb) -> None:
+        with self.sendLock:
+            key = frameProtocol.frameHash(width, height, rgb)
+            seq = self.nextSeq()
+            if key in self.serverFrames:
+                msg = frameProtocol.encodeShow(width, height, key, self.streamId, seq)
+            else:
+                msg = frameProtocol.encodeCachedFrame(width, height, rgb, self.streamId, seq)
+                self.serverFrames.add(key)
+            self.lastCachedFrame = (width, height, rgb, key)
+            self.publishFrame(msg)
+
+    # The server loops the clip from memory until something replaces it
+    def sendClip(self, width: int, height: int, frames: list, durations: list, loopCount=0) -> None:
+        with self.sendLock:
+            seq = self.nextSeq()
+            self.publish(frameProtocol.encodeClip(width, height, frames, durations, loopCount, self.streamId, seq), self.properties)
+
+    # Publishes what is still in the outbox, then disconnects
+    def close(self, timeout=5.0) -> None:
+        self.stopEvent.set()
+        self.thread.join(timeout)
+        if self.dropped:
+            print(f"Dropped {self.dropped} messages while the broker was behind")
+        with self.sendLock:
+            if self.shm:
+                self.shm.close()
+                self.shm = None
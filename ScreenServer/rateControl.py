@@ -0,0 +1,60 @@
+#
+# Producer side frame rate control
+#  The screen server publishes a status message on the control exchange
+#  every second: the frame rate it can sustain and how many messages wait in
+#  its queue. Producers pace their frames from it, backing off while the
+#  queue builds up and skipping frames while the server is behind, so the
+#  queue stays near empty instead of filling with stale frames.
+#
+#  Without a recent status (older server, no control queue) producers just
+#  run at the rate they asked for.
+#
+
+import time
+
+STATUS_TIMEOUT = 5.0
+MAX_INTERVAL = 10.0
+
+
+class RateController:
+    def __init__(self, fps: float, maxQueue=4):
+        self.requestedInterval = 1.0 / fps
+        self.currentInterval = self.requestedInterval
+        self.maxQueue = maxQueue
+        self.serverFps = None
+        self.queueDepth = 0
+        self.statusTime = None
+
+    def handleControl(self, dat: dict) -> None:
+        if dat.get("type") != "status":
+            return
+        self.serverFps = dat.get("sustainableFps")
+        self.queueDepth = dat.get("queueDepth", 0)
+        self.statusTime = time.monotonic()
+
+        floor = self.requestedInterval
+        if self.serverFps:
+            floor = max(floor, 1.0 / self.serverFps)
+
+        # Back off quickly while the queue builds, ease back in slowly
+        if self.queueDepth > self.maxQueue:
+            self.currentInterval = min(self.currentInterval * 2, MAX_INTERVAL)
+        else:
+            self.currentInterval *= 0.8
+        self.currentInterval = max(self.currentInterval, floor)
+
+    def hasStatus(self) -> bool:
+        return self.statusTime is not None and time.monotonic() - self.statusTime < STATUS_TIMEOUT
+
+    # Seconds to wait before the next frame
+    def interval(self) -> float:
+        if not self.hasStatus():
+            return self.requestedInterval
+        return self.currentInterval
+
+    # True while the server is behind: drop this frame rather than queue it
+    def shouldSkip(self) -> bool:
+        return self.hasStatus() and self.queueDepth > self.maxQueue
+
+    def __str__(self):
+        return f"{1.0 / self.interval():.2f} fps (server {self.serverFps}, queue {self.queueDepth})"
@@ -1,54 +1,559 @@
 #!/usr/bin/env python3
 from samplebase import SampleBase
+import frameProtocol
+import shmTransport
+import frameStats
+import frameCache
+import colorPipeline
+import virtualCanvas
+import channelMux
+import frameRecorder
+import screenState
 
 from random import randint, uniform
 from time import sleep
+import threading
+import time
 
 import pika, os, sys
 import json
 from pprint import pprint
+import functools
+import signal
 
 
-class Coordinate:
-    def __init__(self, x, y):
+# Sequence state of one producer stream and the canvas region it last drew
+class StreamState:
+    def __init__(self, seq, x, y, width, height):
+        self.seq = seq
         self.x = x
         self.y = y
+        self.width = width
+        self.height = height
 
-class Color:
-    def __init__(self, r, g, b):
-        self.r = r
-        self.g = g
-        self.b = b
+    def sameRegion(self, header) -> bool:
+        return (self.x, self.y, self.width, self.height) == (header.x, header.y, header.width, header.height)
 
-class Pixel:
-    def __init__(self, coordinate, color):
-        self.coordinate = coordinate
-        self.color = color
+    def overlaps(self, x, y, width, height) -> bool:
+        return x < self.x + self.width and self.x < x + width and y < self.y + self.height and self.y < y + height
+
+
+# Uploaded animation, played from memory by the render thread
+class Clip:
+    def __init__(self, x, y, width, height, frames, durations, loopCount):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.durations = durations
+        self.loopCount = loopCount      # 0 loops forever
+
+        self.index = -1
+        self.loopsDone = 0
+        self.nextFrameTime = None
+        self.finished = False
+
+    # Returns the frame due at now, or None if the current one stays up
+    def advance(self, now):
+        if self.nextFrameTime is not None and now < self.nextFrameTime:
+            return None
+
+        self.index += 1
+        if self.index == len(self.frames):
+            self.loopsDone += 1
+            if self.loopCount and self.loopsDone >= self.loopCount:
+                self.finished = True
+                return None
+            self.index = 0
+
+        # Stay on the clip's own timeline unless playback fell a frame behind
+        duration = self.durations[self.index]
+        if self.nextFrameTime is None or now - self.nextFrameTime > duration:
+            self.nextFrameTime = now
+        self.nextFrameTime += duration
+        return self.frames[self.index]
 
 
 class ScreenServer(SampleBase):
     def __init__(self, *args, **kwargs):
         super(ScreenServer, self).__init__(*args, **kwargs)
+        self.parser.add_argument("--shm-ring", action="store", help=f"Create a shared memory frame ring for local producers at this path, e.g. {shmTransport.DEFAULT_PATH}. Default: off", default="", type=str)
+        self.parser.add_argument("--target-fps", action="store", help="Maximum frames per second swapped onto the panel. Default: 30", default=30, type=float)
+        self.parser.add_argument("--tile-size", action="store", help="Edge of the square tiles only the changed ones of which are redrawn. Default: 8", default=8, type=int)
+        self.parser.add_argument("--shm-channel", action="store", help=f"Screen channel the shared memory ring's frames are drawn on. Default: {shmTransport.CHANNEL}", default=shmTransport.CHANNEL, type=str)
+        self.parser.add_argument("--shm-priority", action="store", help="Priority of the shared memory ring's channel. Default: 0", default=0, type=int)
+        self.parser.add_argument("--channel-dwell", action="store", help="Seconds each of several equal priority channels stays on screen. Default: 30", default=30.0, type=float)
+        self.parser.add_argument("--channel-timeout", action="store", help="Seconds without messages after which the channel on screen gives way to the others. Default: 10", default=10.0, type=float)
+        self.parser.add_argument("--max-clip-bytes", action="store", help="Largest animation clip upload accepted. Default: 16 MB", default=16 * 1024 * 1024, type=int)
+        self.parser.add_argument("--frame-cache-bytes", action="store", help="Memory for frames producers can show by hash. Default: 4 MB", default=4 * 1024 * 1024, type=int)
+        self.parser.add_argument("--color-config", action="store", help="JSON gamma / white balance / brightness correction applied to every frame, reloaded on SIGHUP. Default: none", default="", type=str)
+        self.parser.add_argument("--stats-file", action="store", help="Periodically write frame pipeline stats (JSON) to this file. Default: off", default="", type=str)
+        self.parser.add_argument("--stats-interval", action="store", help="Seconds between stats file writes. Default: 10", default=10.0, type=float)
+        self.parser.add_argument("--status-interval", action="store", help="Seconds between status messages (sustainable fps, queue depth) to producers, 0 for none. Default: 1", default=1.0, type=float)
+        self.parser.add_argument("--prefetch", action="store", help="Messages the broker hands out ahead of the one being drawn; the rest wait in the queue where producers can see them. Default: 8", default=8, type=int)
+        self.parser.add_argument("--state-file", action="store", help="Save what is on screen (frame and clips) to this file and put it back up on startup. Default: off", default="", type=str)
+        self.parser.add_argument("--state-interval", action="store", help="Most seconds the saved screen state lags behind. Default: 10", default=10.0, type=float)
+        self.parser.add_argument("--record", action="store", help="Append every received message to this frame log, for frameReplay.py. Default: off", default="", type=str)
+        self.parser.add_argument("--metrics-port", action="store", help="Serve plain text frame pipeline metrics on http://*:PORT/metrics. Default: off", default=0, type=int)
+        self.connection = None
+        self.channel = None
+        self.queueName = None
+        self.frameCache = None
+        self.recorder = None
+        self.shmRing = None
+
+        # Producers draw on named screen channels, each with a virtual canvas
+        #  covering every chained / parallel panel. They draw regions of it
+        #  and may send deltas against what they drew last
+        #  Written by the consumer thread, read by the render thread
+        self.frameLock = threading.Lock()
+        self.mux = None
+        self.resyncPending = set()
+
+        # Latest-frame-wins slot: a frame that arrives before the render
+        #  thread picked up the previous one supersedes it
+        self.framePending = False
+        self.pendingTiles = None
+        self.pendingSendTimeNs = 0
+        self.stopRendering = threading.Event()
+        self.stats = frameStats.FrameStats()
+
+        self.colorCorrection = colorPipeline.ColorCorrection()
+        self.colorReloadRequested = False
+
+        # Set when what is on screen changed since the state file was written
+        self.stateDirty = False
+
+        # Render thread only: tiles that differ between the offscreen canvas
+        #  and the one on screen (None when unknown, forcing a full redraw)
+        self.backCanvasTiles = None
+
+    def setupFrame(self, width: int, height: int):
+        self.mux = channelMux.ChannelMux(width, height, self.args.tile_size, self.args.channel_dwell, self.args.channel_timeout)
+
+    # Must hold frameLock. tiles is a set of canvas tiles, None for all
+    #  Any frame that is not from the playing clip replaces the clip
+    #  Channels not on screen only keep their canvas up to date
+    def markFrameReady(self, screenChannel, tiles, supersedes=True, sendTimeNs=0, fromClip=False):
+        if not fromClip:
+            screenChannel.clip = None
+        if screenChannel is not self.mux.active:
+            return
+        if not fromClip:
+            self.stateDirty = True      # The clip itself is saved, not its frames
+        self.pendingSendTimeNs = sendTimeNs
+        if self.framePending:
+            if supersedes:
+                self.stats.increment("dropped")
+            if tiles is None or self.pendingTiles is None:
+                self.pendingTiles = None
+            else:
+                self.pendingTiles |= tiles
+        else:
+            self.pendingTiles = tiles
+        self.framePending = True
+
+    # Must hold frameLock. A stream's deltas are only valid against pixels it
+    #  drew itself, so any write forgets the other streams it overlaps
+    def claimRegion(self, screenChannel, streamId, seq, x, y, width, height):
+        streams = screenChannel.streams
+        overlapped = [otherId for otherId, state in streams.items()
+                      if otherId != streamId and state.overlaps(x, y, width, height)]
+        for otherId in overlapped:
+            del streams[otherId]
+        if streamId != 0:
+            streams[streamId] = StreamState(seq, x, y, width, height)
+
+    # Must hold frameLock. Batched ops draw on an offscreen copy of the
+    #  channel's canvas that only replaces it on flush, so a half drawn frame
+    #  never gets shown. Single ops draw straight on the canvas, unless a
+    #  batch is still waiting for its flush
+    def opCanvas(self, screenChannel, batched: bool):
+        if screenChannel.staging is None and batched:
+            canvas = screenChannel.canvas
+            staging = virtualCanvas.VirtualCanvas(canvas.width, canvas.height, canvas.tileSize)
+            staging.frame[:] = canvas.frame
+            screenChannel.staging = staging
+            screenChannel.stagedTiles = set()
+        if screenChannel.staging is not None:
+            return screenChannel.staging
+        return screenChannel.canvas
+
+    # Must hold frameLock. tiles is a set of canvas tiles, None for all
+    def stageTiles(self, screenChannel, tiles):
+        if tiles is None or screenChannel.stagedTiles is None:
+            screenChannel.stagedTiles = None
+        else:
+            screenChannel.stagedTiles |= tiles
+
+    # Must hold frameLock
+    def flushFrame(self, screenChannel):
+        staging = screenChannel.staging
+        if staging is None:
+            return
+        screenChannel.canvas = staging
+        screenChannel.staging = None
+        self.claimRegion(screenChannel, 0, 0, 0, 0, staging.width, staging.height)
+        self.markFrameReady(screenChannel, screenChannel.stagedTiles)
+
+    # Must hold frameLock
+    def clearFrame(self, screenChannel, batched=False):
+        canvas = self.opCanvas(screenChannel, batched)
+        canvas.clear()
+        if canvas is screenChannel.staging:
+            self.stageTiles(screenChannel, None)
+        else:
+            screenChannel.streams.clear()
+            self.markFrameReady(screenChannel, None)
+
+    # Must hold frameLock
+    def drawPixel(self, screenChannel, x: int, y: int, r: int, g: int, b: int, batched=False):
+        canvas = self.opCanvas(screenChannel, batched)
+        tile = canvas.setPixel(x, y, r, g, b)
+        if tile is None:
+            return
+        if canvas is screenChannel.staging:
+            self.stageTiles(screenChannel, {tile})
+        else:
+            self.claimRegion(screenChannel, 0, 0, x, y, 1, 1)
+            self.markFrameReady(screenChannel, {tile}, supersedes=False)
 
-    def drawPixel(self, pixel: Pixel):
-        self.matrix.SetPixel(pixel.coordinate.x, pixel.coordinate.y, pixel.color.r, pixel.color.g, pixel.color.b)
+    # Must hold frameLock
+    def redrawPixels(self, screenChannel, pixels: list, batched=False):
+        canvas = self.opCanvas(screenChannel, batched)
+        xs = [pixel_dat["coordinate"]["x"] for pixel_dat in pixels]
+        ys = [pixel_dat["coordinate"]["y"] for pixel_dat in pixels]
+        colors = [(pixel_dat["color"]["r"], pixel_dat["color"]["g"], pixel_dat["color"]["b"]) for pixel_dat in pixels]
+        tiles = canvas.setPixels(xs, ys, colors)
+        if canvas is screenChannel.staging:
+            self.stageTiles(screenChannel, tiles)
+        else:
+            self.claimRegion(screenChannel, 0, 0, 0, 0, canvas.width, canvas.height)
+            self.markFrameReady(screenChannel, tiles)
 
-    def redrawPixels(self, pixels: list):
-        # new_canvas = self.matrix.CreateFrameCanvas()
+    def presentFrame(self, canvas, frame: bytes, tiles, sendTimeNs=0):
+        drawStart = time.perf_counter()
 
-        for pixel_dat in pixels:
-            self.new_canvas.SetPixel(
-                pixel_dat["coordinate"]["x"],
-                pixel_dat["coordinate"]["y"],
-                pixel_dat["color"]["r"],
-                pixel_dat["color"]["g"],
-                pixel_dat["color"]["b"]
-            )
+        # The offscreen canvas still holds the frame before the one on
+        #  screen, so it needs the previous frame's tiles as well
+        drawTiles = None
+        if tiles is not None and self.backCanvasTiles is not None:
+            drawTiles = tiles | self.backCanvasTiles
+        tilesDrawn = virtualCanvas.blitTiles(canvas, frame, self.new_canvas, drawTiles)
 
+        swapStart = time.perf_counter()
         self.new_canvas = self.matrix.SwapOnVSync(self.new_canvas)
+        swapEnd = time.perf_counter()
+
+        self.backCanvasTiles = tiles
+        self.stats.increment("tiles_drawn", tilesDrawn)
+
+        self.stats.record("draw", swapStart - drawStart)
+        self.stats.record("swap", swapEnd - swapStart)
+        self.stats.recordSwap(swapEnd)
+        if sendTimeNs:
+            self.recordDelay("latency", sendTimeNs)
+
+    # Producer send stamps are time.monotonic_ns(), only comparable on this host
+    def recordDelay(self, name: str, sendTimeNs: int):
+        delay = (time.monotonic_ns() - sendTimeNs) / 1e9
+        if 0 <= delay < 60:
+            self.stats.record(name, delay)
+
+    # Must hold frameLock
+    def playClip(self, screenChannel, now):
+        clip = screenChannel.clip
+        clipFrame = clip.advance(now)
+        if clip.finished:
+            screenChannel.clip = None
+            return
+        if clipFrame is None:
+            return
+
+        tiles = screenChannel.canvas.writeRegion(clip.x, clip.y, clip.width, clip.height, clipFrame)
+        self.claimRegion(screenChannel, 0, 0, clip.x, clip.y, clip.width, clip.height)
+        self.markFrameReady(screenChannel, tiles, fromClip=True)
+
+    # Must hold frameLock. Switching channels redraws the whole panel
+    def selectChannel(self, now):
+        changed, controls = self.mux.select(now)
+        if changed and self.mux.active is not None:
+            self.framePending = True
+            self.pendingTiles = None
+            self.stateDirty = True
+        for dat in controls:
+            self.publishControl(dat)
+
+    # The active channel's frame and clip first, so it is the one shown again
+    #  on restore, then the other channels' clips
+    def snapshotState(self) -> list:
+        with self.frameLock:
+            active = self.mux.active
+            if active is None:
+                return []
+            canvas = active.canvas
+            frame = bytes(canvas.frame)
+            channels = [active] + [channel for channel in self.mux.channels.values() if channel is not active]
+            clips = [(channel.name, channel.priority, channel.clip) for channel in channels if channel.clip is not None]
+
+        entries = [(active.name, active.priority, frameProtocol.encodeFrame(canvas.width, canvas.height, frame))]
+        for channelName, priority, clip in clips:
+            body = frameProtocol.encodeClip(clip.width, clip.height, clip.frames, clip.durations, clip.loopCount, x=clip.x, y=clip.y)
+            entries.append((channelName, priority, body))
+        return entries
+
+    def saveState(self):
+        self.stateDirty = False
+        try:
+            screenState.save(self.args.state_file, self.snapshotState())
+        except OSError as e:
+            print(f"Screen state save fail: {e}")
+
+    # Saves at most every state interval and only after a change, the state
+    #  file often lives on the Pi's SD card
+    def saveStateLoop(self):
+        while not self.stopRendering.wait(self.args.state_interval):
+            if self.stateDirty:
+                self.saveState()
+
+    # Puts the saved screen back up before any producer is connected
+    def restoreState(self):
+        try:
+            entries = screenState.load(self.args.state_file)
+        except (OSError, ValueError) as e:
+            print(f"Screen state load fail, starting blank: {e}")
+            return
+
+        for channelName, priority, body in entries:
+            with self.frameLock:
+                screenChannel = self.mux.channelFor(channelName, priority, time.monotonic())
+            self.binaryHandler(screenChannel, body)
+        if entries:
+            print(f"Restored {len(entries)} saved screen messages from {self.args.state_file}")
+
+    def loadColorCorrection(self):
+        try:
+            self.colorCorrection = colorPipeline.ColorCorrection.fromFile(self.args.color_config)
+            print(f"Color correction: {self.colorCorrection}")
+        except (OSError, ValueError) as e:
+            print(f"Color config load fail, keeping the previous one: {e}")
+
+    # Runs on the main (consumer) thread between bytecodes, so only set a flag
+    def requestColorReload(self, signum, stackFrame):
+        self.colorReloadRequested = True
+
+    # One pass of the render loop: picks the channel, advances its clip and
+    #  presents the pending frame, if any
+    def renderPending(self):
+        if self.colorReloadRequested:
+            self.colorReloadRequested = False
+            self.loadColorCorrection()
+            with self.frameLock:
+                self.framePending = True
+                self.pendingTiles = None
+
+        frame = None
+        with self.frameLock:
+            now = time.monotonic()
+            self.selectChannel(now)
+            active = self.mux.active
+            if active is not None and active.clip is not None:
+                self.playClip(active, now)
+
+            if self.framePending and active is not None:
+                canvas = active.canvas
+                frame = bytes(canvas.frame)
+                tiles = self.pendingTiles
+                sendTimeNs = self.pendingSendTimeNs
+                self.framePending = False
+                self.pendingTiles = None
+
+        if frame is not None:
+            frame = self.colorCorrection.apply(frame)
+            self.presentFrame(canvas, frame, tiles, sendTimeNs)
+
+    def renderLoop(self):
+        framePeriod = 1.0 / self.args.target_fps
+        nextFrameTime = time.monotonic()
 
+        while not self.stopRendering.is_set():
+            nextFrameTime += framePeriod
+            self.renderPending()
 
-    def jsonHandler(self, msg):
+            delay = nextFrameTime - time.monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                nextFrameTime = time.monotonic()
+
+    # Safe from any thread: pika only allows the consumer thread to publish
+    def publishControl(self, dat: dict):
+        if self.channel is None:
+            return
+        publish = functools.partial(self.channel.basic_publish, exchange=frameProtocol.CONTROL_EXCHANGE, routing_key='', body=json.dumps(dat))
+        self.connection.add_callback_threadsafe(publish)
+
+    # Runs on the consumer thread from a connection timer. Producers pace
+    #  themselves from the status, see rateControl.py
+    def publishStatus(self):
+        self.connection.call_later(self.args.status_interval, self.publishStatus)
+        try:
+            queueDepth = self.channel.queue_declare(queue=self.queueName, passive=True).method.message_count
+        except pika.exceptions.AMQPError as e:
+            print(f"Queue depth check fail: {e}")
+            return
+        dat = {
+            "type": "status",
+            "fps": self.stats.fps(),
+            "sustainableFps": self.stats.sustainableFps(self.args.target_fps),
+            "targetFps": self.args.target_fps,
+            "queueDepth": queueDepth,
+        }
+        self.channel.basic_publish(exchange=frameProtocol.CONTROL_EXCHANGE, routing_key='', body=json.dumps(dat))
+
+    def requestResync(self, streamId: int):
+        if streamId in self.resyncPending:
+            return
+        print(f"Sequence gap on stream {streamId}, requesting keyframe")
+        self.resyncPending.add(streamId)
+        self.publishControl({"type": "resync", "streamId": streamId})
+
+
+    def keyframeHandler(self, screenChannel, header, body):
+        rgb = frameProtocol.decodeFramePayload(header, body)
+        self.showKeyframe(screenChannel, header, rgb)
+
+    def packedFrameHandler(self, screenChannel, header, body):
+        rgb = frameProtocol.decodePackedFrame(header, body)
+        self.showKeyframe(screenChannel, header, rgb)
+
+    # Cached frames are kept packed, they are shown far less often than sent
+    def cachedFrameHandler(self, screenChannel, header, body):
+        rgb = bytes(frameProtocol.decodeFramePayload(header, body))
+        key = frameProtocol.frameHash(header.width, header.height, rgb)
+        # A re-upload only refreshes the entry, packing is the slow part
+        if self.frameCache.get(key) is None:
+            self.frameCache.put(key, header.width, header.height, frameProtocol.packFrame(header.width, header.height, rgb))
+        self.showKeyframe(screenChannel, header, rgb)
+
+    def showHandler(self, screenChannel, header, body):
+        key = frameProtocol.decodeShow(header, body)
+        entry = self.frameCache.get(key)
+        if entry is None:
+            self.stats.increment("cache_misses")
+            self.publishControl({"type": "cacheMiss", "streamId": header.streamId, "hash": key.hex()})
+            return
+
+        width, height, packed = entry
+        if (width, height) != (header.width, header.height):
+            raise frameProtocol.ProtocolError(f"Cached frame is {width}x{height}, not the size of {header}")
+        self.stats.increment("cache_hits")
+        self.showKeyframe(screenChannel, header, frameProtocol.unpackFrame(width, height, packed))
+
+    # rgb is the packed header.width x header.height region at header.x, header.y
+    def showKeyframe(self, screenChannel, header, rgb):
+        with self.frameLock:
+            # Stream 0 is unsequenced
+            state = screenChannel.streams.get(header.streamId)
+            stale = (header.streamId != 0
+                     and state is not None
+                     and not frameProtocol.isNewerSeq(header.seq, state.seq))
+            if not stale:
+                tiles = screenChannel.canvas.writeRegion(header.x, header.y, header.width, header.height, rgb)
+                self.claimRegion(screenChannel, header.streamId, header.seq, header.x, header.y, header.width, header.height)
+                self.markFrameReady(screenChannel, tiles, sendTimeNs=header.sendTimeNs)
+
+        if stale:
+            self.stats.increment("out_of_order")
+            return
+
+        self.resyncPending.discard(header.streamId)
+
+    def clipHandler(self, screenChannel, header, body):
+        if len(body) > self.args.max_clip_bytes:
+            print(f"Rejecting {len(body)} byte clip from stream {header.streamId}, limit is {self.args.max_clip_bytes}")
+            return
+
+        frames, durations, loopCount = frameProtocol.decodeClip(header, body)
+        clip = Clip(header.x, header.y, header.width, header.height, [bytes(frame) for frame in frames], durations, loopCount)
+
+        with self.frameLock:
+            screenChannel.clip = clip       # The render thread starts it on its next tick
+            self.stateDirty = True
+        print(f"Playing {len(frames)} frame clip from stream {header.streamId} on channel {screenChannel.name}")
+
+    def deltaHandler(self, screenChannel, header, body):
+        runs = list(frameProtocol.iterDeltaRuns(header, body))
+
+        with self.frameLock:
+            state = screenChannel.streams.get(header.streamId)
+            inSequence = (state is not None
+                          and header.seq == frameProtocol.nextSeq(state.seq)
+                          and state.sameRegion(header))
+            if inSequence:
+                tiles = screenChannel.canvas.writeRuns(header.x, header.y, header.width, header.height, runs)
+                self.claimRegion(screenChannel, header.streamId, header.seq, header.x, header.y, header.width, header.height)
+                self.markFrameReady(screenChannel, tiles, sendTimeNs=header.sendTimeNs)
+            elif state is not None and not frameProtocol.isNewerSeq(header.seq, state.seq):
+                # Late duplicate of a frame already applied, nothing to resync
+                self.stats.increment("out_of_order")
+                return
+
+        if not inSequence:
+            self.stats.increment("sequence_gaps")
+            self.requestResync(header.streamId)
+
+    # Local producers' frames from the shared memory ring. Only the newest
+    #  slot is read, so deltas (which need every frame) are refused here
+    def shmLoop(self, ring):
+        pollPeriod = 0.5 / self.args.target_fps
+        lastSeq = 0
+        while not self.stopRendering.is_set():
+            ring.beat()
+            latest = ring.readLatest(lastSeq)
+            if latest is None:
+                sleep(pollPeriod)
+                continue
+
+            seq, body = latest
+            try:
+                self.handleBody(body, self.args.shm_channel, self.args.shm_priority, fromRing=True)
+            finally:
+                body.release()
+
+            if not ring.isIntact(seq):
+                print(f"Shared memory frame {seq} was overwritten while being read")
+            lastSeq = seq
+
+    def binaryHandler(self, screenChannel, body, fromRing=False):
+        try:
+            header = frameProtocol.decodeHeader(body)
+            if header.sendTimeNs:
+                self.recordDelay("queue_delay", header.sendTimeNs)
+
+            if header.msgType == frameProtocol.MSG_FRAME:
+                self.keyframeHandler(screenChannel, header, body)
+            elif header.msgType == frameProtocol.MSG_PACKED_FRAME:
+                self.packedFrameHandler(screenChannel, header, body)
+            elif header.msgType == frameProtocol.MSG_SHOW:
+                self.showHandler(screenChannel, header, body)
+            elif header.msgType == frameProtocol.MSG_CACHED_FRAME:
+                self.cachedFrameHandler(screenChannel, header, body)
+            elif fromRing:
+                print(f"Ignoring message that needs every frame from shared memory: {header}")
+            elif header.msgType == frameProtocol.MSG_DELTA:
+                self.deltaHandler(screenChannel, header, body)
+            elif header.msgType == frameProtocol.MSG_CLIP:
+                self.clipHandler(screenChannel, header, body)
+            else:
+                print(f"Unknown binary message: {header}")
+        except frameProtocol.ProtocolError as e:
+            self.stats.increment("decode_errors")
+            print(f"Binary frame decode fail: {e}")
+
+
+    def jsonHandler(self, screenChannel, msg):
         try:
             dat = json.loads(msg)
         except:
@@ -56,45 +561,136 @@ class ScreenServer(SampleBase):
             return
         #pprint(dat)
 
+        with self.frameLock:
+            if dat["type"] == "batch":
+                for op in dat["ops"]:
+                    self.jsonOp(screenChannel, op, batched=True)
+            else:
+                self.jsonOp(screenChannel, dat)
+
+    # Must hold frameLock
+    def jsonOp(self, screenChannel, dat: dict, batched=False):
         if dat["type"] == "clear":
-            self.matrix.Clear()
+            self.clearFrame(screenChannel, batched)
         elif dat["type"] == "drawPixel":
-            coord = Coordinate(dat["pixel"]["coordinate"]["x"],
-                               dat["pixel"]["coordinate"]["y"])
-            color = Color(
-                dat["pixel"]["color"]["r"],
-                dat["pixel"]["color"]["g"],
-                dat["pixel"]["color"]["b"])
-
-            pixel = Pixel(coord, color)
-
-            self.drawPixel(pixel)
+            coordinate = dat["pixel"]["coordinate"]
+            color = dat["pixel"]["color"]
+            self.drawPixel(screenChannel, coordinate["x"], coordinate["y"], color["r"], color["g"], color["b"], batched)
         elif dat["type"] == "redraw":
             pixels = dat["pixels"]
             # pprint(pixels)
-            self.redrawPixels(pixels)
+            self.redrawPixels(screenChannel, pixels, batched)
+        elif dat["type"] == "flush":
+            self.flushFrame(screenChannel)
+        else:
+            print(f"Unknown JSON op: {dat['type']}")
 
 
-    def messageHandler(self, ch, method, properties, body):
-        msg = str(body, 'utf-8')
-        if msg[0] == '{':
-            self.jsonHandler(msg)
+    def handleBody(self, body, channelName=frameProtocol.DEFAULT_CHANNEL, priority=0, fromRing=False):
+        self.stats.increment("received")
+        if self.recorder is not None:
+            self.recorder.append(body, channelName, priority)
+        decodeStart = time.perf_counter()
+
+        with self.frameLock:
+            screenChannel = self.mux.channelFor(channelName, priority, time.monotonic())
+
+        if frameProtocol.isBinaryMessage(body):
+            self.binaryHandler(screenChannel, body, fromRing)
         else:
-            print(f"Unknown message format: {msg}")
+            msg = str(body, 'utf-8')
+            if msg[0] == '{':
+                self.jsonHandler(screenChannel, msg)
+            else:
+                print(f"Unknown message format: {msg}")
 
+        self.stats.record("decode", time.perf_counter() - decodeStart)
 
-    def run(self):
+    def messageHandler(self, ch, method, properties, body):
+        headers = properties.headers or {}
+        channelName = str(headers.get(frameProtocol.CHANNEL_HEADER, frameProtocol.DEFAULT_CHANNEL))
+        try:
+            priority = int(headers.get(frameProtocol.PRIORITY_HEADER, 0))
+        except (TypeError, ValueError):
+            priority = 0
+        self.handleBody(body, channelName, priority)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+    # Everything but the broker connection: canvas, render thread, shared
+    #  memory ring, recording and stats
+    def setupRendering(self):
         self.new_canvas = self.matrix.CreateFrameCanvas()
+        self.setupFrame(self.matrix.width, self.matrix.height)
+        self.frameCache = frameCache.FrameCache(self.args.frame_cache_bytes)
+        if self.args.color_config:
+            self.loadColorCorrection()
+            signal.signal(signal.SIGHUP, self.requestColorReload)
+
+        renderThread = threading.Thread(target=self.renderLoop, name="render", daemon=True)
+        renderThread.start()
+
+        if self.args.state_file:
+            self.restoreState()
+            stateThread = threading.Thread(target=self.saveStateLoop, name="state", daemon=True)
+            stateThread.start()
+
+        if self.args.shm_ring:
+            slotSize = shmTransport.slotSizeFor(self.matrix.width, self.matrix.height)
+            ring = shmTransport.createRing(self.args.shm_ring, slotSize)
+            self.shmRing = ring
+            shmThread = threading.Thread(target=self.shmLoop, args=(ring,), name="shm", daemon=True)
+            shmThread.start()
+            print(f"Reading local frames from {self.args.shm_ring}")
+
+        if self.args.stats_file:
+            statsThread = threading.Thread(target=self.stats.writeLoop, args=(self.args.stats_file, self.args.stats_interval, self.stopRendering), name="stats", daemon=True)
+            statsThread.start()
+        if self.args.metrics_port:
+            frameStats.startMetricsServer(self.stats, self.args.metrics_port)
+            print(f"Serving metrics on port {self.args.metrics_port}")
+        if self.args.record:
+            self.recorder = frameRecorder.FrameRecorder(self.args.record)
+            print(f"Recording messages to {self.args.record}")
+
+    def stopRenderingThreads(self):
+        self.stopRendering.set()
+        if self.shmRing is not None:
+            # Producers go back to the broker
+            self.shmRing.unlink()
+        if self.args.state_file and self.stateDirty:
+            self.saveState()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    # localBroker.py stands in for the broker in benchmarks
+    def openConnection(self):
+        return pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+
+    def run(self):
+        self.setupRendering()
 
         queueName = 'MazeScreen'
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+        self.queueName = queueName
+        connection = self.openConnection()
+        self.connection = connection
         channel = connection.channel()
         channel.queue_declare(queue=queueName)
+        channel.exchange_declare(exchange=frameProtocol.CONTROL_EXCHANGE, exchange_type='fanout')
+        self.channel = channel
 
-        channel.basic_consume(queue=queueName, on_message_callback=self.messageHandler, auto_ack=True)
+        # Acked, prefetch limited delivery keeps the backlog in the broker's
+        #  queue, where it shows in the status and stale frames can expire
+        channel.basic_qos(prefetch_count=self.args.prefetch)
+        channel.basic_consume(queue=queueName, on_message_callback=self.messageHandler, auto_ack=False)
+        if self.args.status_interval > 0:
+            connection.call_later(self.args.status_interval, self.publishStatus)
 
         print(' [*] Waiting for messages. To exit press CTRL+C')
-        channel.start_consuming()
+        try:
+            channel.start_consuming()
+        finally:
+            self.stopRenderingThreads()
 
 
 # Main function
@@ -4,7 +4,6 @@ import sys
 import os
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/..'))
-from rgbmatrix import RGBMatrix, RGBMatrixOptions
 
 
 class SampleBase(object):
@@ -30,6 +29,8 @@ class SampleBase(object):
         self.parser.add_argument("--led-panel-type", action="store", help="Needed to initialize special panels. Supported: 'FM6126A'", default="", type=str)
         self.parser.add_argument("--led-no-drop-privs", dest="drop_privileges", help="Don't drop privileges from 'root' after initializing the hardware.", action='store_false')
         self.parser.set_defaults(drop_privileges=True)
+        self.parser.add_argument("--led-backend", action="store", help="Matrix backend: rgbmatrix (the panel) or emulator (in-process, no hardware). Default: rgbmatrix", choices=['rgbmatrix', 'emulator'], default='rgbmatrix', type=str)
+        self.parser.add_argument("--led-emulator-refresh", action="store", help="Simulated vsync rate of the emulator backend in Hz, 0 to never block. Default: 120", default=120.0, type=float)
 
     def usleep(self, value):
         time.sleep(value / 1000000.0)
@@ -37,8 +38,12 @@ class SampleBase(object):
     def run(self):
         print("Running")
 
-    def process(self):
-        self.args = self.parser.parse_args()
+    def createMatrix(self):
+        if self.args.led_backend == 'emulator':
+            from matrixEmulator import EmulatedRGBMatrix, EmulatedRGBMatrixOptions
+            RGBMatrixOptions = EmulatedRGBMatrixOptions
+        else:
+            from rgbmatrix import RGBMatrix, RGBMatrixOptions
 
         options = RGBMatrixOptions()
 
@@ -68,7 +73,13 @@ class SampleBase(object):
         if not self.args.drop_privileges:
           options.drop_privileges=False
 
-        self.matrix = RGBMatrix(options = options)
+        if self.args.led_backend == 'emulator':
+            return EmulatedRGBMatrix(options, refreshRate=self.args.led_emulator_refresh)
+        return RGBMatrix(options = options)
+
+    def process(self):
+        self.args = self.parser.parse_args()
+        self.matrix = self.createMatrix()
 
         try:
             # Start loop
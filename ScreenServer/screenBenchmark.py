@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# End to end throughput benchmark of the screen pipeline
+#  Runs each producer's frame generation through mazergb's encode and
+#  publish, the in-process broker of localBroker.py and the screen server's
+#  decode and draw path onto the emulated matrix, all in this process.
+#  Reports per producer: messages/s the server took, frames/s it swapped
+#  onto the panel, bytes per message on the queue and p50 / p99 latency
+#  from producer send to panel swap.
+#
+#  Producers send flat out by default (--producer-fps 0), so latency then
+#  includes the time frames wait in the queue.
+#
+#  e.g. ./screenBenchmark.py --led-backend emulator --led-emulator-refresh 0 --target-fps 1000
+#
+
+from rgbScreenServer import ScreenServer
+import localBroker
+import mazergb
+import framePacer
+
+import importlib.util
+import json
+import os
+import random
+import threading
+import time
+
+from PIL import Image
+
+REPO_DIR = os.path.abspath(os.path.dirname(__file__) + "/..")
+PRODUCERS = ["life", "spotlight", "logo", "dataset"]
+
+
+# Producer scripts are not importable modules (cgol-rgb.py), load them by path
+def loadProducer(path: str):
+    name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ****************************************************************************
+# Each returns a step(client) that makes and sends one frame the way the
+#  producer's main loop does
+def lifeProducer(args):
+    cgol = loadProducer("ConwaysGameOfLife/cgol-rgb.py")
+    world = cgol.World(maxx=38, maxy=38, engine=args.life_engine)
+    world.seedRandom()
+
+    def step(client):
+        world.tick()
+        world.handleStuck()
+        frame = world.getScreenFrame(3, 3, 32, 32)
+        client.sendDelta(frame.width, frame.height, frame.tobytes(), changed=world.takeScreenChanges(3, 3, 32, 32))
+    return step
+
+
+def spotlightProducer(args):
+    spotlightModule = loadProducer("pixmap/pilSpotlightRGB.py")
+    spotlight = spotlightModule.Spotlight(Image.open(os.path.join(REPO_DIR, "pixmap/place1000x1000.png")), 32, 32)
+
+    def step(client):
+        spotlight.tick()
+        client.sendImage(spotlight.getSpotlightImage())
+    return step
+
+
+def logoProducer(args):
+    logoModule = loadProducer("kraken/logoScreenSaver.py")
+    logoDir = os.path.join(REPO_DIR, "kraken/logos")
+    logoImages = logoModule.LogoImages([os.path.join(logoDir, name) for name in sorted(os.listdir(logoDir))])
+
+    def step(client):
+        client.sendImage(logoImages.getNextLogoImage())
+    return step
+
+
+# The CIFAR dataset files aren't in the repo, so this shows random picks
+#  from a set of noise images through the frame cache like the dataset
+#  producer does
+def datasetProducer(args, imageCount=100):
+    rng = random.Random(1)
+    images = [bytes(rng.getrandbits(8) for i in range(32 * 32 * 3)) for image in range(imageCount)]
+
+    def step(client):
+        client.sendCachedFrame(32, 32, rng.choice(images))
+    return step
+
+
+PRODUCER_FACTORIES = {
+    "life": lifeProducer,
+    "spotlight": spotlightProducer,
+    "logo": logoProducer,
+    "dataset": datasetProducer,
+}
+
+
+# ****************************************************************************
+# Screen server on the in-process broker
+class LocalScreenServer(ScreenServer):
+    def __init__(self, broker, *args, **kwargs):
+        super(LocalScreenServer, self).__init__(*args, **kwargs)
+        self.broker = broker
+
+    def openConnection(self):
+        return self.broker.connect()
+
+    def stopConsuming(self):
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+
+
+# Parses the server's arguments as well, for the servers it benchmarks against
+class BenchmarkServer(ScreenServer):
+    def __init__(self, *args, **kwargs):
+        super(BenchmarkServer, self).__init__(*args, **kwargs)
+        self.parser.add_argument("--producers", action="store", nargs="+", help=f"Producers to run. Default: all of {' '.join(PRODUCERS)}", choices=PRODUCERS, default=PRODUCERS)
+        self.parser.add_argument("--frames", action="store", help="Frames each producer sends. Default: 300", default=300, type=int)
+        self.parser.add_argument("--producer-fps", action="store", help="Rate producers send at, 0 for flat out. Default: 0", default=0.0, type=float)
+        self.parser.add_argument("--life-engine", action="store", help="World engine of the life producer. Default: cells", default="cells", type=str)
+        self.parser.add_argument("--results", action="store", help="Also write the results as JSON to this file. Default: off", default="", type=str)
+
+    # Fresh server, broker and emulated matrix per producer, so every
+    #  producer has the panel to itself and its own stats
+    def benchmark(self, producerName: str) -> dict:
+        server = LocalScreenServer(localBroker.LocalBroker())
+        server.args = self.args
+        server.matrix = server.createMatrix()
+        serverThread = threading.Thread(target=server.run, name="server", daemon=True)
+        serverThread.start()
+        while server.channel is None and serverThread.is_alive():
+            time.sleep(0.01)
+
+        step = PRODUCER_FACTORIES[producerName](self.args)
+        client = mazergb.ScreenClient(producerName, useShm=False, outboxSize=self.args.frames,
+                                      connectionFactory=server.broker.connect)
+        pacer = framePacer.FramePacer(producerName, reportInterval=0)
+
+        startTime = time.monotonic()
+        for frame in range(self.args.frames):
+            step(client)
+            if self.args.producer_fps > 0:
+                pacer.wait(1.0 / self.args.producer_fps)
+        sendTime = time.monotonic() - startTime
+        client.close(timeout=60.0)
+
+        while server.broker.pending(server.queueName):
+            time.sleep(0.001)
+        elapsed = time.monotonic() - startTime
+
+        # Let the render thread present the last frame
+        time.sleep(2.0 / self.args.target_fps)
+        server.stopConsuming()
+        serverThread.join(10.0)
+
+        stats = server.stats.snapshot()
+        messages = server.broker.publishedCount.get(server.queueName, 0)
+        messageBytes = server.broker.publishedBytes.get(server.queueName, 0)
+        latency = stats["timings"]["latency"]
+        return {
+            "producer": producerName,
+            "frames": self.args.frames,
+            "sendSeconds": sendTime,
+            "seconds": elapsed,
+            "messages": messages,
+            "messagesPerSecond": stats["counters"]["received"] / elapsed,
+            "renderedPerSecond": stats["counters"]["rendered"] / elapsed,
+            "bytesPerMessage": messageBytes / messages if messages else 0.0,
+            "latencyP50": latency.get("p50", 0.0),
+            "latencyP99": latency.get("p99", 0.0),
+            "dropped": client.dropped,
+            "expired": server.broker.expiredCount,
+            "stats": stats,
+        }
+
+    def run(self):
+        results = []
+        for producerName in self.args.producers:
+            print(f"Benchmarking {producerName}")
+            results.append(self.benchmark(producerName))
+
+        print()
+        print(f"{'producer':<10} {'msgs/s':>9} {'frames/s':>9} {'bytes/msg':>10} {'p50 ms':>8} {'p99 ms':>8} {'dropped':>8}")
+        for result in results:
+            print(f"{result['producer']:<10} {result['messagesPerSecond']:>9.1f} {result['renderedPerSecond']:>9.1f} "
+                  f"{result['bytesPerMessage']:>10.1f} {result['latencyP50'] * 1000:>8.2f} {result['latencyP99'] * 1000:>8.2f} "
+                  f"{result['dropped'] + result['expired']:>8}")
+
+        if self.args.results:
+            with open(self.args.results, "w") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {self.args.results}")
+
+
+# Main function
+if __name__ == "__main__":
+    benchmarkServer = BenchmarkServer()
+    if (not benchmarkServer.process()):
+        benchmarkServer.print_help()
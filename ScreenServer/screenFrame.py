@@ -0,0 +1,108 @@
+#
+# Frame of RGB pixels for screen producers and the server
+#  One contiguous (height, width, 3) uint8 array instead of a Pixel object
+#  and a nested dict per pixel. Built from PIL images, cell grids or packed
+#  RGB888 bytes and serialized straight to the wire formats.
+#
+#  Cell grids are column major (cells[x][y], as World.getScreenCells returns
+#  them) of cells with isLive() and getColor() giving an object with r, g, b
+#
+
+import numpy
+from PIL import Image
+
+import frameProtocol
+
+
+class Frame:
+    def __init__(self, width: int, height: int, pixels=None):
+        self.width = width
+        self.height = height
+        if pixels is None:
+            pixels = numpy.zeros((height, width, 3), dtype=numpy.uint8)
+        self.pixels = numpy.ascontiguousarray(pixels, dtype=numpy.uint8)
+        if not self.pixels.flags.writeable:
+            # Views of bytes and PIL images are read only, frames get drawn on
+            self.pixels = self.pixels.copy()
+        if self.pixels.shape != (height, width, 3):
+            raise ValueError(f"Pixels are {self.pixels.shape}, expected {(height, width, 3)}")
+
+    @classmethod
+    def fromImage(cls, image: Image.Image):
+        width, height = image.size
+        return cls(width, height, numpy.asarray(image.convert("RGB")))
+
+    @classmethod
+    def fromBytes(cls, width: int, height: int, rgb):
+        if len(rgb) != width * height * 3:
+            raise ValueError(f"Frame is {len(rgb)} bytes, expected {width * height * 3}")
+        return cls(width, height, numpy.frombuffer(rgb, dtype=numpy.uint8).reshape(height, width, 3))
+
+    @classmethod
+    def fromCells(cls, cells):
+        width = len(cells)
+        height = len(cells[0])
+        frame = cls(width, height)
+        pixels = frame.pixels
+        for x in range(width):
+            column = cells[x]
+            for y in range(height):
+                cell = column[y]
+                if cell.isLive():
+                    color = cell.getColor()
+                    pixels[y, x] = (color.r, color.g, color.b)
+        return frame
+
+    # Boolean (height, width) mask painted with one color or a matching
+    #  (height, width, 3) array of colors, black elsewhere
+    @classmethod
+    def fromMask(cls, mask, colors=(255, 255, 255)):
+        height, width = mask.shape
+        frame = cls(width, height)
+        colors = numpy.asarray(colors, dtype=numpy.uint8)
+        frame.pixels[mask] = colors[mask] if colors.ndim == 3 else colors
+        return frame
+
+    def copy(self):
+        return Frame(self.width, self.height, self.pixels.copy())
+
+    def clear(self) -> None:
+        self.pixels[:] = 0
+
+    def setPixel(self, x: int, y: int, r: int, g: int, b: int) -> None:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y, x] = (r, g, b)
+
+    # Packed RGB888, row major, as every binary message carries it
+    def tobytes(self) -> bytes:
+        return self.pixels.tobytes()
+
+    def toImage(self) -> Image.Image:
+        return Image.fromarray(self.pixels, "RGB")
+
+    def __eq__(self, other):
+        return isinstance(other, Frame) and numpy.array_equal(self.pixels, other.pixels)
+
+    # ************************************************************************
+    # Wire formats
+    def encode(self, streamId=0, seq=0, x=0, y=0) -> bytes:
+        return frameProtocol.encodeFrame(self.width, self.height, self.tobytes(), streamId, seq, x, y)
+
+    def encodePacked(self, streamId=0, seq=0, x=0, y=0) -> bytes:
+        return frameProtocol.encodePackedFrame(self.width, self.height, self.tobytes(), streamId, seq, x, y)
+
+    # JSON pixel dicts of every pixel, row by row, for a redraw message
+    def redrawPixels(self) -> list:
+        ys, xs = numpy.indices((self.height, self.width)).reshape(2, -1)
+        return pixelDicts(xs, ys, self.pixels.reshape(-1, 3))
+
+    # JSON drawPixel ops for the pixels that are not black, for a batch
+    def drawOps(self) -> list:
+        ys, xs = numpy.nonzero(self.pixels.any(axis=2))
+        return [{"type": "drawPixel", "pixel": pixel} for pixel in pixelDicts(xs, ys, self.pixels[ys, xs])]
+
+
+# Zipped in one pass over plain ints, the dicts are what the JSON needs
+def pixelDicts(xs, ys, colors) -> list:
+    return [{"coordinate": {"x": x, "y": y}, "color": {"r": r, "g": g, "b": b}}
+            for x, y, (r, g, b) in zip(xs.tolist(), ys.tolist(), colors.tolist())]
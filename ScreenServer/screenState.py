@@ -0,0 +1,71 @@
+#
+# Last screen contents, persisted so a restarted server can put them back on
+#  the panel before the broker is even connected
+#  The file holds frame protocol messages (the canvas as a MSG_FRAME, clips
+#  as MSG_CLIP) with the screen channel they were drawn on, in the order
+#  they are to be replayed
+#
+#  Layout: state header, then entries of [entry header][channel name][message]
+#
+
+import os
+import struct
+
+STATE_MAGIC = b"MZST"
+STATE_VERSION = 1
+
+# magic, version, entry count
+STATE_HEADER = struct.Struct("<4sHH")
+# message length, priority, channel name length
+ENTRY_HEADER = struct.Struct("<IhH")
+
+
+class StateError(ValueError):
+    pass
+
+
+# entries is a list of (channel name, priority, message)
+#  Written to a temporary file first, so a crash never leaves half a state
+def save(path: str, entries: list) -> None:
+    parts = [STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(entries))]
+    for channelName, priority, body in entries:
+        name = channelName.encode("utf-8")
+        priority = max(-0x8000, min(0x7FFF, priority))     # From the producer's header
+        parts.append(ENTRY_HEADER.pack(len(body), priority, len(name)))
+        parts.append(name)
+        parts.append(body)
+
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(b"".join(parts))
+    os.replace(tmpPath, path)
+
+
+# Returns the saved entries, [] when there is no state yet
+def load(path: str) -> list:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+
+    if len(data) < STATE_HEADER.size:
+        raise StateError(f"{path} is too short for a screen state")
+    magic, version, count = STATE_HEADER.unpack_from(data)
+    if magic != STATE_MAGIC or version != STATE_VERSION:
+        raise StateError(f"{path} is not a version {STATE_VERSION} screen state")
+
+    entries = []
+    pos = STATE_HEADER.size
+    for index in range(count):
+        if pos + ENTRY_HEADER.size > len(data):
+            raise StateError(f"Truncated entry {index} in {path}")
+        bodyLength, priority, nameLength = ENTRY_HEADER.unpack_from(data, pos)
+        pos += ENTRY_HEADER.size
+        end = pos + nameLength + bodyLength
+        if end > len(data):
+            raise StateError(f"Truncated entry {index} in {path}")
+        channelName = data[pos:pos + nameLength].decode("utf-8")
+        entries.append((channelName, priority, data[pos + nameLength:end]))
+        pos = end
+    return entries
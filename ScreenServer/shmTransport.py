@@ -0,0 +1,177 @@
+#
+# Shared memory frame ring for producers running on the same Pi as the server
+#  The server creates a memory mapped file (normally in /dev/shm), a single
+#  local producer claims it with flock() and writes binary frame messages into
+#  it round robin. The server only ever shows the newest frame, reading it in
+#  place from the mapping, so the broker and both JSON passes drop out.
+#
+#  Layout: ring header, then slotCount slots of [slot header][payload]
+#  A slot's sequence number is zeroed while the writer fills it, so the
+#  reader can tell a finished slot from one being overwritten.
+#
+#  The server stamps the header with a monotonic heartbeat while it reads the
+#  ring and unlinks the file when it stops, so producers only write to a
+#  ring that is being read and fall back to the broker otherwise.
+#
+
+import os
+import mmap
+import fcntl
+import struct
+import time
+
+import frameProtocol
+
+DEFAULT_PATH = "/dev/shm/MazeScreen"
+
+# Screen channel the server draws the ring's frames on unless told otherwise
+CHANNEL = "local"
+
+RING_MAGIC = b"MZSH"
+RING_VERSION = 2
+
+# magic, version, slot count, slot payload size, reader heartbeat (monotonic
+#  ns), newest committed sequence
+RING_HEADER = struct.Struct("<4sHHIQQ")
+# sequence, payload length
+SLOT_HEADER = struct.Struct("<QI4x")
+WRITE_SEQ_OFFSET = RING_HEADER.size - 8
+HEARTBEAT_OFFSET = WRITE_SEQ_OFFSET - 8
+
+# A ring whose reader has not stamped it for this long is not being read
+HEARTBEAT_TIMEOUT = 2.0
+
+
+class RingError(Exception):
+    pass
+
+
+# ****************************************************************************
+class ShmFrameRing:
+    def __init__(self, path: str, slotCount: int, slotSize: int, mm, fd):
+        self.path = path
+        self.slotCount = slotCount
+        self.slotSize = slotSize
+        self.mm = mm
+        self.fd = fd
+        self.view = memoryview(mm)
+
+    def slotOffset(self, seq: int) -> int:
+        return RING_HEADER.size + (seq % self.slotCount) * (SLOT_HEADER.size + self.slotSize)
+
+    def writeSeq(self) -> int:
+        return struct.unpack_from("<Q", self.mm, WRITE_SEQ_OFFSET)[0]
+
+    # True while the reader stamps the ring and the path still leads to it
+    def isAlive(self) -> bool:
+        heartbeat = struct.unpack_from("<Q", self.mm, HEARTBEAT_OFFSET)[0]
+        if time.monotonic_ns() - heartbeat > HEARTBEAT_TIMEOUT * 1e9:
+            return False
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self.fd).st_ino
+        except OSError:
+            return False
+
+    def close(self):
+        self.view.release()
+        self.mm.close()
+        os.close(self.fd)
+
+
+# ****************************************************************************
+# Server side: owns the file and reads the newest slot without copying
+class ShmFrameReader(ShmFrameRing):
+    # Returns (seq, memoryview of the message), or None if nothing newer than lastSeq
+    def readLatest(self, lastSeq: int):
+        seq = self.writeSeq()
+        if seq == 0 or seq == lastSeq:
+            return None
+
+        offset = self.slotOffset(seq)
+        slotSeq, length = SLOT_HEADER.unpack_from(self.mm, offset)
+        if slotSeq != seq or length > self.slotSize:
+            return None
+
+        start = offset + SLOT_HEADER.size
+        return seq, self.view[start:start + length]
+
+    # True if the writer has not started reusing the slot of seq since it was read
+    def isIntact(self, seq: int) -> bool:
+        slotSeq, length = SLOT_HEADER.unpack_from(self.mm, self.slotOffset(seq))
+        return slotSeq == seq and self.writeSeq() - seq < self.slotCount - 1
+
+    def beat(self) -> None:
+        struct.pack_into("<Q", self.mm, HEARTBEAT_OFFSET, time.monotonic_ns())
+
+    # Takes the ring away from producers, unless a newer server replaced it
+    def unlink(self) -> None:
+        try:
+            if os.stat(self.path).st_ino == os.fstat(self.fd).st_ino:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+
+# Built in a new file that is renamed over the path: producers still mapping
+#  an old ring keep a valid (unread) mapping rather than a truncated one
+def createRing(path: str, slotSize: int, slotCount=8) -> ShmFrameReader:
+    size = RING_HEADER.size + slotCount * (SLOT_HEADER.size + slotSize)
+
+    tmpPath = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmpPath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o666)
+    os.fchmod(fd, 0o666)    # producers run as other users
+    os.ftruncate(fd, size)
+    mm = mmap.mmap(fd, size)
+    RING_HEADER.pack_into(mm, 0, RING_MAGIC, RING_VERSION, slotCount, slotSize, time.monotonic_ns(), 0)
+    os.replace(tmpPath, path)
+
+    return ShmFrameReader(path, slotCount, slotSize, mm, fd)
+
+
+# ****************************************************************************
+# Producer side
+class ShmFrameWriter(ShmFrameRing):
+    def publish(self, msg) -> None:
+        if len(msg) > self.slotSize:
+            raise RingError(f"Message of {len(msg)} bytes does not fit {self.slotSize} byte slots")
+
+        seq = self.writeSeq() + 1
+        offset = self.slotOffset(seq)
+        start = offset + SLOT_HEADER.size
+
+        SLOT_HEADER.pack_into(self.mm, offset, 0, 0)
+        self.view[start:start + len(msg)] = msg
+        SLOT_HEADER.pack_into(self.mm, offset, seq, len(msg))
+        struct.pack_into("<Q", self.mm, WRITE_SEQ_OFFSET, seq)
+
+
+# Returns a writer for the server's ring, or None when there is no ring, it
+#  is not being read or another local producer already holds it
+def openWriter(path=DEFAULT_PATH):
+    try:
+        fd = os.open(path, os.O_RDWR)
+    except OSError:
+        return None
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        mm = mmap.mmap(fd, 0)
+    except (OSError, ValueError):
+        os.close(fd)
+        return None
+
+    magic, version, slotCount, slotSize, heartbeat, seq = RING_HEADER.unpack_from(mm, 0)
+    if magic != RING_MAGIC or version != RING_VERSION:
+        mm.close()
+        os.close(fd)
+        return None
+
+    writer = ShmFrameWriter(path, slotCount, slotSize, mm, fd)
+    if not writer.isAlive():
+        writer.close()
+        return None
+    return writer
+
+
+def slotSizeFor(width: int, height: int) -> int:
+    return frameProtocol.HEADER_SIZE + width * height * 3
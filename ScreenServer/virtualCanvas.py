@@ -0,0 +1,121 @@
+#
+# Virtual canvas covering the whole chained / parallel panel area
+#  Producers write rectangular regions of it. Every write reports the tiles
+#  it touched so the render thread only rewrites those tiles of the panel.
+#
+
+from PIL import Image
+import numpy
+
+
+class VirtualCanvas:
+    def __init__(self, width: int, height: int, tileSize=8):
+        self.width = width
+        self.height = height
+        self.tileSize = tileSize
+        self.tilesX = (width + tileSize - 1) // tileSize
+        self.tilesY = (height + tileSize - 1) // tileSize
+        self.frame = bytearray(width * height * 3)
+        # (height, width, 3) view sharing frame's memory
+        self.pixels = numpy.frombuffer(self.frame, dtype=numpy.uint8).reshape(height, width, 3)
+
+    # Returns (x, y, w, h) of the region clipped to the canvas, or None
+    def clipRect(self, x: int, y: int, w: int, h: int):
+        x1 = min(x + w, self.width)
+        y1 = min(y + h, self.height)
+        if x >= x1 or y >= y1:
+            return None
+        return x, y, x1 - x, y1 - y
+
+    def tilesForRect(self, x: int, y: int, w: int, h: int) -> set:
+        tiles = set()
+        for tileY in range(y // self.tileSize, (y + h - 1) // self.tileSize + 1):
+            rowStart = tileY * self.tilesX
+            tiles.update(range(rowStart + x // self.tileSize, rowStart + (x + w - 1) // self.tileSize + 1))
+        return tiles
+
+    def tileRect(self, tile: int):
+        x = (tile % self.tilesX) * self.tileSize
+        y = (tile // self.tilesX) * self.tileSize
+        return x, y, min(self.tileSize, self.width - x), min(self.tileSize, self.height - y)
+
+    def allTiles(self) -> set:
+        return set(range(self.tilesX * self.tilesY))
+
+    # rgb is a packed w x h RGB888 region placed with its top left at (x, y)
+    def writeRegion(self, x: int, y: int, w: int, h: int, rgb) -> set:
+        clipped = self.clipRect(x, y, w, h)
+        if clipped is None:
+            return set()
+        x, y, clippedW, clippedH = clipped
+
+        frame = self.frame
+        rowBytes = clippedW * 3
+        for row in range(clippedH):
+            dst = ((y + row) * self.width + x) * 3
+            src = row * w * 3
+            frame[dst:dst + rowBytes] = rgb[src:src + rowBytes]
+        return self.tilesForRect(x, y, clippedW, clippedH)
+
+    # Delta runs address pixels of the w x h region at (x, y), row major
+    def writeRuns(self, x: int, y: int, w: int, h: int, runs) -> set:
+        frame = self.frame
+        tiles = set()
+        for offset, count, rgb in runs:
+            src = 0
+            while count > 0:
+                regionX = offset % w
+                regionY = offset // w
+                span = min(count, w - regionX)
+                canvasX = x + regionX
+                canvasY = y + regionY
+
+                clipped = self.clipRect(canvasX, canvasY, span, 1)
+                if clipped is not None:
+                    clippedW = clipped[2]
+                    dst = (canvasY * self.width + canvasX) * 3
+                    frame[dst:dst + clippedW * 3] = rgb[src:src + clippedW * 3]
+                    tiles |= self.tilesForRect(canvasX, canvasY, clippedW, 1)
+
+                offset += span
+                count -= span
+                src += span * 3
+        return tiles
+
+    # Returns the touched tile, None when outside the canvas
+    def setPixel(self, x: int, y: int, r: int, g: int, b: int):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return None
+        offset = (y * self.width + x) * 3
+        self.frame[offset:offset + 3] = bytes((r, g, b))
+        return (y // self.tileSize) * self.tilesX + x // self.tileSize
+
+    # Many pixels in one go: xs, ys and (n, 3) colors as arrays or lists.
+    #  Pixels outside the canvas are skipped; returns the touched tiles
+    def setPixels(self, xs, ys, colors) -> set:
+        xs = numpy.asarray(xs, dtype=numpy.int64)
+        ys = numpy.asarray(ys, dtype=numpy.int64)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        xs = xs[inside]
+        ys = ys[inside]
+        self.pixels[ys, xs] = numpy.asarray(colors, dtype=numpy.uint8).reshape(-1, 3)[inside]
+        tiles = (ys // self.tileSize) * self.tilesX + xs // self.tileSize
+        return set(numpy.unique(tiles).tolist())
+
+    def clear(self) -> None:
+        self.frame[:] = bytes(len(self.frame))
+
+
+# ****************************************************************************
+# Copies the given tiles of a packed canvas-sized frame onto a matrix canvas,
+#  or the whole frame when tiles is None
+def blitTiles(canvas: VirtualCanvas, frame: bytes, target, tiles) -> int:
+    image = Image.frombuffer("RGB", (canvas.width, canvas.height), frame, "raw", "RGB", 0, 1)
+    if tiles is None:
+        target.SetImage(image)
+        return canvas.tilesX * canvas.tilesY
+
+    for tile in tiles:
+        x, y, w, h = canvas.tileRect(tile)
+        target.SetImage(image.crop((x, y, x + w, y + h)), x, y)
+    return len(tiles)
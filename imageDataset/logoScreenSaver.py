@@ -8,33 +8,14 @@
 
 from typing import List
 from PIL import Image
-from time import sleep
 import random
-import pika
-import json
-from pprint import pprint
 import sys
-from progress.bar import Bar
-
-
-# ****************************************************************************
-class Pixel:
-    def __init__(self, x, y, r, g, b):
-        self.x = x
-        self.y = y
-        self.r = r
-        self.g = g
-        self.b = b
-
-    def getDat(self) -> dict:
-        dat = {
-            "coordinate": {"x": self.x, "y": self.y},
-            "color": {"r": self.r, "g": self.g, "b": self.b},
-        }
-        return dat
+import os
 
-    def __str__(self) -> str:
-        return json.dumps(self.getDat())
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../ScreenServer"))
+import mazergb
+import framePacer
+from progress.bar import Bar
 
 
 # ****************************************************************************
@@ -101,52 +82,6 @@ class DatasetImages:
 
 
 
-# ****************************************************************************
-class RMQWrapper:
-    def __init__(self):
-        self.setupRMQ()
-
-    def setupRMQ(self) -> None:
-        print("Connecting to RMQ server -- ", end="")
-        self.queueName = "MazeScreen"
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host="localhost")
-        )
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(queue=self.queueName)
-        print("Connected.")
-
-    def publish(self, msg) -> None:
-        try:
-            self.channel.basic_publish(
-                exchange="", routing_key=self.queueName, body=msg
-            )
-        except pika.exceptions.StreamLostError as e:
-            pprint(e)
-            self.setupRMQ()
-
-    def close(self) -> None:
-        self.connection.close()
-
-    def sendClear(self) -> None:
-        dat = {"type": "clear"}
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-    def sendScreenRedraw(self, screen) -> None:
-        dat = {"type": "redraw", "pixels": []}
-
-        width, height = screen.size
-        for x in range(width):
-            for y in range(height):
-                r, g, b, a = screen.getpixel((x, y))
-                pixel = Pixel(x, y, r, g, b)
-                dat["pixels"].append(pixel.getDat())
-
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-
 # ** *************************************************************************
 if __name__ == "__main__":
     print("Starting Logo Renderer.")
@@ -163,19 +98,23 @@ if __name__ == "__main__":
 
     logoImages = DatasetImages(logoFilenames)
 
-    rmq = RMQWrapper()
+    client = mazergb.ScreenClient("logos", fps=1.0 / sleepDelay)
 
     print("Starting Logo Render")
 
+    pacer = framePacer.FramePacer("logos", reportInterval=600.0)
     try:
         while True:
-            #rmq.sendScreenRedraw(logoImages.getNextLogoImage())
-            rmq.sendScreenRedraw(logoImages.getRandomLogoImage())
-            sleep(sleepDelay)
+            #client.sendRedraw(logoImages.getNextLogoImage())
+            if not client.paused:
+                image = logoImages.getRandomLogoImage()
+                width, height = image.size
+                client.sendCachedFrame(width, height, image.convert("RGB").tobytes())
+            pacer.wait(sleepDelay)
     except KeyboardInterrupt:
         print("Caught keyboard interrupt - quitting")
 
-    rmq.sendClear()
-    rmq.close()
+    client.sendClear()
+    client.close()
 
     print("Done.")
@@ -8,32 +8,11 @@
 
 from typing import List
 from PIL import Image
-from time import sleep
-import random
-import pika
-import json
-from pprint import pprint
 import sys
+import os
 
-
-# ****************************************************************************
-class Pixel:
-    def __init__(self, x, y, r, g, b):
-        self.x = x
-        self.y = y
-        self.r = r
-        self.g = g
-        self.b = b
-
-    def getDat(self) -> dict:
-        dat = {
-            "coordinate": {"x": self.x, "y": self.y},
-            "color": {"r": self.r, "g": self.g, "b": self.b},
-        }
-        return dat
-
-    def __str__(self) -> str:
-        return json.dumps(self.getDat())
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../ScreenServer"))
+import mazergb
 
 
 # ****************************************************************************
@@ -62,52 +41,6 @@ class LogoImages:
 
 
 
-# ****************************************************************************
-class RMQWrapper:
-    def __init__(self):
-        self.setupRMQ()
-
-    def setupRMQ(self) -> None:
-        print("Connecting to RMQ server -- ", end="")
-        self.queueName = "MazeScreen"
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host="localhost")
-        )
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(queue=self.queueName)
-        print("Connected.")
-
-    def publish(self, msg) -> None:
-        try:
-            self.channel.basic_publish(
-                exchange="", routing_key=self.queueName, body=msg
-            )
-        except pika.exceptions.StreamLostError as e:
-            pprint(e)
-            self.setupRMQ()
-
-    def close(self) -> None:
-        self.connection.close()
-
-    def sendClear(self) -> None:
-        dat = {"type": "clear"}
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-    def sendScreenRedraw(self, screen) -> None:
-        dat = {"type": "redraw", "pixels": []}
-
-        width, height = screen.size
-        for x in range(width):
-            for y in range(height):
-                r, g, b, a = screen.getpixel((x, y))
-                pixel = Pixel(x, y, r, g, b)
-                dat["pixels"].append(pixel.getDat())
-
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-
 # ** *************************************************************************
 if __name__ == "__main__":
     print("Starting Logo Renderer.")
@@ -124,18 +57,14 @@ if __name__ == "__main__":
 
     logoImages = LogoImages(logoFilenames)
 
-    rmq = RMQWrapper()
-
-    print("Starting Logo Render")
-
-    try:
-        while True:
-            rmq.sendScreenRedraw(logoImages.getNextLogoImage())
-            sleep(sleepDelay)
-    except KeyboardInterrupt:
-        print("Caught keyboard interrupt - quitting")
+    # The clip goes through the broker, the ring only carries single frames
+    client = mazergb.ScreenClient("kraken", useShm=False)
 
-    rmq.sendClear()
-    rmq.close()
+    print("Uploading logo clip")
+    width, height = logoImages.logoImages[0].size
+    frames = [image.convert("RGB").tobytes() for image in logoImages.logoImages]
+    client.sendClip(width, height, frames, [sleepDelay] * len(frames))
+    client.close()
+    print("Clip uploaded, the screen server keeps playing it until replaced")
 
     print("Done.")
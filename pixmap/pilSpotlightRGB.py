@@ -11,30 +11,12 @@
 from PIL import Image
 from time import sleep
 import random
-import pika
-import json
-from pprint import pprint
 import sys
+import os
 
-
-# ****************************************************************************
-class Pixel:
-    def __init__(self, x, y, r, g, b):
-        self.x = x
-        self.y = y
-        self.r = r
-        self.g = g
-        self.b = b
-
-    def getDat(self) -> dict:
-        dat = {
-            "coordinate": {"x": self.x, "y": self.y},
-            "color": {"r": self.r, "g": self.g, "b": self.b},
-        }
-        return dat
-
-    def __str__(self) -> str:
-        return json.dumps(self.getDat())
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../ScreenServer"))
+import mazergb
+import framePacer
 
 
 # ****************************************************************************
@@ -125,56 +107,9 @@ class Spotlight:
             self.handleBounce()
 
 
-# ****************************************************************************
-class RMQWrapper:
-    def __init__(self):
-        self.setupRMQ()
-
-    def setupRMQ(self) -> None:
-        print("Connecting to RMQ server -- ", end="")
-        self.queueName = "MazeScreen"
-        self.connection = pika.BlockingConnection(
-            pika.ConnectionParameters(host="localhost")
-        )
-        self.channel = self.connection.channel()
-        self.channel.queue_declare(queue=self.queueName)
-        print("Connected.")
-
-    def publish(self, msg) -> None:
-        try:
-            self.channel.basic_publish(
-                exchange="", routing_key=self.queueName, body=msg
-            )
-        except pika.exceptions.StreamLostError as e:
-            pprint(e)
-            self.setupRMQ()
-
-    def close(self) -> None:
-        self.connection.close()
-
-    def sendClear(self) -> None:
-        dat = {"type": "clear"}
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-    def sendScreenRedraw(self, screen) -> None:
-        dat = {"type": "redraw", "pixels": []}
-
-        width, height = screen.size
-        for x in range(width):
-            for y in range(height):
-                r, g, b, a = screen.getpixel((x, y))
-                pixel = Pixel(x, y, r, g, b)
-                dat["pixels"].append(pixel.getDat())
-
-        msg = json.dumps(dat)
-        self.publish(msg)
-
-
 # ** *************************************************************************
 if __name__ == "__main__":
     print("Starting Spotlight Generator.")
-    sleepDelay = 0.25
 
     if len(sys.argv) < 2:
         print(f"Usage: {sys.argv[0]} <background image file>")
@@ -186,21 +121,29 @@ if __name__ == "__main__":
         print(e)
         sys.exit()
 
-    rmq = RMQWrapper()
+    client = mazergb.ScreenClient("spotlight", fps=4.0)
     spotlight = Spotlight(fullImage, 32, 32)
 
     print("Starting spotlight's main movement")
 
+    # Skipped frames still move the spotlight, so it keeps its speed when sending falls behind
+    pacer = framePacer.FramePacer("spotlight", skipFrames=True)
     try:
         while True:
+            if client.paused:
+                sleep(1)
+                pacer.reset()
+                continue
             spotlight.tick()
-            newSpotlightImage = spotlight.getSpotlightImage()
-            rmq.sendScreenRedraw(newSpotlightImage)
-            sleep(sleepDelay)
+            if not client.rate.shouldSkip():
+                newSpotlightImage = spotlight.getSpotlightImage()
+                client.sendImage(newSpotlightImage)
+            for skipped in range(pacer.wait(client.rate.interval())):
+                spotlight.tick()
     except KeyboardInterrupt:
         print("Caught keyboard interrupt - quitting")
 
-    rmq.sendClear()
-    rmq.close()
+    client.sendClear()
+    client.close()
 
     print("Done.")
@@ -4,6 +4,11 @@ from PIL import Image
 import pygame
 from time import sleep
 import random
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__) + "/../ScreenServer"))
+import framePacer
 
 minTick = 0.3
 
@@ -58,6 +63,7 @@ if __name__ == "__main__":
     maxX, maxY = im.size
 
     sleepDelay = 0.05
+    pacer = framePacer.FramePacer("spotlightPygame")
 
     while True:
         if currX <= 0 or (currX + screenX) >= maxX:
@@ -76,7 +82,7 @@ if __name__ == "__main__":
         currY += yTick
 
         if int(lastX) == int(currX) and int(lastY) == int(currY):
-            sleep(sleepDelay)
+            pacer.wait(sleepDelay)
             continue
 
         # Update screen with new currX & currY
@@ -94,7 +100,7 @@ if __name__ == "__main__":
         gameDisplay.blit(py_image, (1,1))
         pygame.display.update()
 
-        sleep(sleepDelay)
+        pacer.wait(sleepDelay)
 
 
     for y in range(0, height - 32, 32):